@@ -1,19 +1,21 @@
 """API endpoints for video processing."""
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import asyncio
 import os
-import json
+import anyio
+import orjson
 
 from app.core.config import settings
-from app.services.video_processor import VideoProcessor
+from app.core.cache import cache
+from app.core.job_store import job_store, tracking_cache_key, video_ext_key, TRACKING_CACHE_TTL
+from app.core.storage import storage
+from app.workers.tasks import process_video_task, run_video_job
 
 router = APIRouter()
-video_processor = VideoProcessor()
-
-# In-memory storage for processing status (use Redis in production)
-processing_status = {}
 
 class ProcessRequest(BaseModel):
     video_id: str
@@ -25,38 +27,62 @@ class ProcessStatusResponse(BaseModel):
     message: str
     logs: List[str] = []
 
+async def _find_video_path(video_id: str) -> Optional[str]:
+    """
+    Locate an uploaded video from its recorded extension, else one directory
+    scan. Multipart uploads are on local disk even with STORAGE_TYPE=s3, so
+    the bucket is only checked for videos that aren't.
+    """
+    file_ext = await cache.get(video_ext_key(video_id))
+    videos_dir = os.path.join(settings.STORAGE_PATH, "videos")
+    if file_ext is not None:
+        video_path = os.path.join(videos_dir, f"{video_id}{file_ext}")
+        if os.path.exists(video_path):
+            return video_path
+    
+    with os.scandir(videos_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[0] == video_id:
+                return entry.path
+    
+    if settings.STORAGE_TYPE == "s3":
+        # Workers presign the object themselves right before streaming it
+        key = await anyio.to_thread.run_sync(storage.locate_video, video_id, file_ext)
+        if key is not None:
+            return storage.object_uri(key)
+    
+    return None
+
 @router.post("/process")
 async def start_processing(request: ProcessRequest, background_tasks: BackgroundTasks):
-    """Start background video processing."""
+    """Start video processing on a Celery worker, or in-process without Redis."""
     
     # Find video file with any extension
-    videos_dir = os.path.join(settings.STORAGE_PATH, "videos")
-    video_path = None
-    for ext in ['.mp4', '.mov', '.avi', '.webm', '.mkv']:
-        potential_path = os.path.join(videos_dir, f"{request.video_id}{ext}")
-        if os.path.exists(potential_path):
-            video_path = potential_path
-            break
-    
+    video_path = await _find_video_path(request.video_id)
     if not video_path:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    # Check if already processing
-    if request.video_id in processing_status:
-        status = processing_status[request.video_id]
-        if status["status"] == "processing":
-            return {"message": "Video is already being processed", "status": status}
+    # Only one worker may submit a given video at a time
+    lock_token = await job_store.acquire_lock(request.video_id)
+    if lock_token is None:
+        status = await job_store.get(request.video_id)
+        return {"message": "Video is already being processed", "status": status}
+    
+    # Check if already processing (job outlived the submission lock)
+    status = await job_store.get(request.video_id)
+    if status and status["status"] == "processing":
+        await job_store.release_lock(request.video_id, lock_token)
+        return {"message": "Video is already being processed", "status": status}
     
     # Initialize status
-    processing_status[request.video_id] = {
-        "status": "processing",
-        "progress": 0.0,
-        "message": "Starting video processing...",
-        "logs": []
-    }
+    await job_store.create(request.video_id, "Starting video processing...")
     
-    # Start background task
-    background_tasks.add_task(process_video_task, request.video_id, video_path)
+    # Hand off to a GPU worker; it releases the lock when done
+    if cache.enabled:
+        process_video_task.delay(request.video_id, video_path, lock_token)
+    else:
+        # No Redis: no broker either, so process in this API process
+        background_tasks.add_task(run_video_job, request.video_id, video_path, lock_token)
     
     return {
         "message": "Video processing started",
@@ -67,7 +93,8 @@ async def start_processing(request: ProcessRequest, background_tasks: Background
 async def get_processing_status(video_id: str):
     """Get processing status for a video."""
     
-    if video_id not in processing_status:
+    status = await job_store.get(video_id)
+    if status is None:
         # Check if tracking file exists (already processed)
         tracking_path = os.path.join(settings.STORAGE_PATH, 'tracking', f'{video_id}_tracking.json')
         if os.path.exists(tracking_path):
@@ -80,64 +107,78 @@ async def get_processing_status(video_id: str):
         else:
             raise HTTPException(status_code=404, detail="Video not found or not processed")
     
-    status = processing_status[video_id]
     return ProcessStatusResponse(
         video_id=video_id,
         status=status["status"],
         progress=status["progress"],
         message=status["message"],
-        logs=status.get("logs", [])
+        logs=status["logs"]
     )
 
+@router.websocket("/ws/process/{video_id}")
+async def process_status_ws(websocket: WebSocket, video_id: str):
+    """Push processing status updates instead of having clients poll."""
+    await websocket.accept()
+    
+    try:
+        # Subscribe before the snapshot so no update falls in between
+        async with job_store.subscribe(video_id) as events:
+            status = await job_store.get(video_id)
+            if status is None:
+                await websocket.close(code=4404, reason="Video not found or not processed")
+                return
+            
+            await websocket.send_json(status)
+            if status["status"] != "processing":
+                await websocket.close()
+                return
+            
+            async def forward_events():
+                async for event in events:
+                    await websocket.send_json(event)
+                    if event.get("status") in ("completed", "failed"):
+                        return
+            
+            async def wait_for_disconnect():
+                # Clients send nothing, so the only message is the disconnect
+                while (await websocket.receive())["type"] != "websocket.disconnect":
+                    pass
+                raise WebSocketDisconnect()
+            
+            # A stalled or queued job may never publish again, so also watch
+            # the socket; whichever finishes first tears down the other and
+            # the pubsub subscription with it
+            tasks = [asyncio.create_task(forward_events()), asyncio.create_task(wait_for_disconnect())]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            for task in done:
+                task.result()
+        
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @router.get("/tracking/{video_id}")
 async def get_tracking_data(video_id: str):
     """Get tracking data for a processed video."""
     
+    cache_key = tracking_cache_key(video_id)
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(cached)
+    
     tracking_path = os.path.join(settings.STORAGE_PATH, 'tracking', f'{video_id}_tracking.json')
     
     if not os.path.exists(tracking_path):
         raise HTTPException(status_code=404, detail="Tracking data not found. Video may not be processed yet.")
     
-    with open(tracking_path, 'r') as f:
-        data = json.load(f)
+    data = orjson.loads(await anyio.Path(tracking_path).read_bytes())
     
-    return data
-
-async def process_video_task(video_id: str, video_path: str):
-    """Background task to process video."""
-    try:
-        # Initialize logs storage
-        if "logs" not in processing_status[video_id]:
-            processing_status[video_id]["logs"] = []
-        
-        async def update_progress(progress: float, message: str = None):
-            processing_status[video_id]["progress"] = progress
-            if message:
-                processing_status[video_id]["message"] = message
-            else:
-                processing_status[video_id]["message"] = f"Processing... {progress:.1f}%"
-        
-        async def log_message(message: str):
-            if "logs" not in processing_status[video_id]:
-                processing_status[video_id]["logs"] = []
-            processing_status[video_id]["logs"].append(message)
-            # Keep only last 50 logs to avoid memory issues
-            if len(processing_status[video_id]["logs"]) > 50:
-                processing_status[video_id]["logs"] = processing_status[video_id]["logs"][-50:]
-        
-        # Process video
-        await video_processor.process_video(video_id, video_path, update_progress, log_message)
-        
-        # Update status
-        processing_status[video_id]["status"] = "completed"
-        processing_status[video_id]["progress"] = 100.0
-        processing_status[video_id]["message"] = "Video processing completed successfully"
-        
-    except Exception as e:
-        print(f"Error processing video {video_id}: {e}")
-        processing_status[video_id] = {
-            "status": "failed",
-            "progress": 0.0,
-            "message": f"Processing failed: {str(e)}",
-            "logs": processing_status[video_id].get("logs", [])
-        }
+    await cache.set(cache_key, data, expire=TRACKING_CACHE_TTL)
+    
+    return ORJSONResponse(data)
@@ -1,15 +1,62 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.responses import RedirectResponse
 from datetime import datetime
+import hashlib
 import os
+import shutil
 import uuid
-import aiofiles
+import anyio
 
 from app.core.config import settings
-from app.schemas.video import VideoUploadRequest, VideoResponse
-from app.services.video_processor import VideoProcessor
+from app.core.cache import cache
+from app.core.job_store import video_ext_key, VIDEO_EXT_TTL
+from app.core.storage import storage
+from app.schemas.video import (
+    VideoUploadRequest,
+    VideoResponse,
+    PresignUploadRequest,
+    PresignUploadResponse,
+    FinalizeUploadRequest
+)
+from app.services.video_metadata import probe_metadata
 
 router = APIRouter()
-video_processor = VideoProcessor()
+
+# Copy uploads to disk in fixed-size chunks so memory stays bounded
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+def _copy_upload(src, dest_path: str):
+    """Copy the spooled upload to disk in one thread, without per-chunk awaits."""
+    src.seek(0)
+    with open(dest_path, 'wb') as out_file:
+        shutil.copyfileobj(src, out_file, UPLOAD_CHUNK_SIZE)
+
+# ffprobe results are memoized by a fingerprint of the file's head and tail
+FINGERPRINT_BYTES = 64 * 1024
+METADATA_CACHE_TTL = 30 * 24 * 60 * 60
+
+def _fingerprint_file(path: str) -> str:
+    """Hash the size plus first/last 64 KiB; cheap compared to an ffprobe run."""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+async def _extract_metadata_cached(file_path: str) -> dict:
+    fingerprint = await anyio.to_thread.run_sync(_fingerprint_file, file_path)
+    cache_key = f"meta:{fingerprint}"
+    
+    metadata = await cache.get(cache_key)
+    if metadata is None:
+        metadata = await anyio.to_thread.run_sync(probe_metadata, file_path)
+        if metadata:
+            await cache.set(cache_key, metadata, expire=METADATA_CACHE_TTL)
+    
+    return metadata
 
 @router.post("/videos", response_model=VideoResponse)
 async def upload_video(
@@ -27,16 +74,18 @@ async def upload_video(
         file_ext = os.path.splitext(file.filename)[1]
         file_path = os.path.join(settings.STORAGE_PATH, "videos", f"{video_id}{file_ext}")
         
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            content = await file.read()
-            await out_file.write(content)
+        try:
+            await anyio.to_thread.run_sync(_copy_upload, file.file, file_path)
+        finally:
+            await file.close()
+        
+        await cache.set(video_ext_key(video_id), file_ext, expire=VIDEO_EXT_TTL)
         
         video_url = f"/static/videos/{video_id}{file_ext}"
+        metadata = await _extract_metadata_cached(file_path)
     else:
-        file_path = None
         video_url = url
-    
-    metadata = await video_processor.extract_metadata(file_path if file_path else url)
+        metadata = await anyio.to_thread.run_sync(probe_metadata, url)
     
     # Return video info without database (stateless mode)
     return VideoResponse(
@@ -51,5 +100,65 @@ async def upload_video(
         created_at=datetime.utcnow()
     )
 
+@router.post("/videos/presign", response_model=PresignUploadResponse)
+async def presign_upload(request: PresignUploadRequest):
+    """Return a presigned PUT URL so the browser uploads straight to object storage."""
+    if settings.STORAGE_TYPE != "s3":
+        raise HTTPException(status_code=400, detail="Direct uploads require STORAGE_TYPE=s3")
+    
+    video_id = str(uuid.uuid4())
+    file_ext = os.path.splitext(request.filename)[1]
+    object_key = storage.video_key(video_id, file_ext)
+    
+    return PresignUploadResponse(
+        video_id=video_id,
+        object_key=object_key,
+        upload_url=storage.presign_upload(object_key, request.content_type),
+        expires_in=settings.PRESIGNED_URL_EXPIRY
+    )
+
+@router.post("/videos/finalize", response_model=VideoResponse)
+async def finalize_upload(request: FinalizeUploadRequest):
+    """Register a video the browser uploaded with a presigned URL."""
+    if settings.STORAGE_TYPE != "s3":
+        raise HTTPException(status_code=400, detail="Direct uploads require STORAGE_TYPE=s3")
+    
+    file_ext = os.path.splitext(request.object_key)[1]
+    if request.object_key != storage.video_key(request.video_id, file_ext):
+        raise HTTPException(status_code=400, detail="Object key does not match video id")
+    
+    if not await anyio.to_thread.run_sync(storage.exists, request.object_key):
+        raise HTTPException(status_code=404, detail="Uploaded video not found in storage")
+    
+    await cache.set(video_ext_key(request.video_id), file_ext, expire=VIDEO_EXT_TTL)
+    
+    metadata = await anyio.to_thread.run_sync(probe_metadata, storage.presign_download(request.object_key))
+    
+    return VideoResponse(
+        video_id=request.video_id,
+        # Stable: presigned URLs expire, so players go through get_video_file
+        url=f"/api/videos/{request.video_id}/file",
+        title=request.title or f"Video {request.video_id[:8]}",
+        description=request.description,
+        duration=metadata.get("duration"),
+        width=metadata.get("width"),
+        height=metadata.get("height"),
+        fps=metadata.get("fps"),
+        created_at=datetime.utcnow()
+    )
+
+@router.get("/videos/{video_id}/file")
+async def get_video_file(video_id: str):
+    """Redirect to a freshly presigned URL for a video in object storage."""
+    if settings.STORAGE_TYPE != "s3":
+        raise HTTPException(status_code=400, detail="Video files are served from /static without STORAGE_TYPE=s3")
+    
+    file_ext = await cache.get(video_ext_key(video_id))
+    key = await anyio.to_thread.run_sync(storage.locate_video, video_id, file_ext)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    return RedirectResponse(storage.presign_download(key))
+
 # get_video endpoint removed - not needed in stateless mode
 # Video info is stored in tracking JSON files
@@ -1,48 +1,138 @@
 import redis.asyncio as redis
 from app.core.config import settings
-import json
-from typing import Optional, Any
+import orjson
+from contextlib import asynccontextmanager
+from typing import Optional, Any, Dict, List, AsyncIterator
+
+# Deletes a lock only while it still holds the caller's token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 
 class CacheManager:
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
     
+    @property
+    def enabled(self) -> bool:
+        """Caching is skipped entirely when REDIS_URL is empty."""
+        return bool(settings.REDIS_URL)
+    
     async def connect(self):
+        # Raw bytes: orjson parses them directly without a str round-trip
         self.redis_client = await redis.from_url(
             settings.REDIS_URL,
-            encoding="utf-8",
-            decode_responses=True
+            decode_responses=False
         )
     
     async def disconnect(self):
         if self.redis_client:
             await self.redis_client.close()
+            self.redis_client = None
     
     async def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
         if not self.redis_client:
             await self.connect()
         value = await self.redis_client.get(key)
         if value:
-            return json.loads(value)
+            return orjson.loads(value)
         return None
     
     async def set(self, key: str, value: Any, expire: int = 3600):
+        if not self.enabled:
+            return
         if not self.redis_client:
             await self.connect()
         await self.redis_client.set(
             key,
-            json.dumps(value),
+            orjson.dumps(value),
             ex=expire
         )
     
     async def delete(self, key: str):
+        if not self.enabled:
+            return
         if not self.redis_client:
             await self.connect()
         await self.redis_client.delete(key)
     
     async def exists(self, key: str) -> bool:
+        if not self.enabled:
+            return False
         if not self.redis_client:
             await self.connect()
         return await self.redis_client.exists(key) > 0
+    
+    async def acquire_lock(self, key: str, token: str, expire: int) -> bool:
+        """Atomically take a lock key; returns False if someone else holds it."""
+        if not self.redis_client:
+            await self.connect()
+        return bool(await self.redis_client.set(key, token, nx=True, ex=expire))
+    
+    async def release_lock(self, key: str, token: str):
+        """Delete a lock key, unless it expired and someone else took it since."""
+        if not self.redis_client:
+            await self.connect()
+        await self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+    
+    async def hset(self, key: str, mapping: Dict[str, Any], expire: Optional[int] = None):
+        if not self.redis_client:
+            await self.connect()
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            if expire:
+                pipe.expire(key, expire)
+            await pipe.execute()
+    
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        if not self.redis_client:
+            await self.connect()
+        values = await self.redis_client.hgetall(key)
+        return {k.decode(): v.decode() for k, v in values.items()}
+    
+    async def push_capped(self, key: str, value: str, max_length: int, expire: Optional[int] = None):
+        """Append to a list, keeping only the newest max_length entries."""
+        if not self.redis_client:
+            await self.connect()
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, value)
+            pipe.ltrim(key, -max_length, -1)
+            if expire:
+                pipe.expire(key, expire)
+            await pipe.execute()
+    
+    async def lrange(self, key: str, start: int = 0, end: int = -1) -> List[str]:
+        if not self.redis_client:
+            await self.connect()
+        values = await self.redis_client.lrange(key, start, end)
+        return [v.decode() for v in values]
+    
+    async def publish(self, channel: str, value: Any):
+        if not self.redis_client:
+            await self.connect()
+        await self.redis_client.publish(channel, orjson.dumps(value))
+    
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        """Subscribe to a channel; yields an iterator of decoded messages."""
+        if not self.redis_client:
+            await self.connect()
+        pubsub = self.redis_client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            yield self._iter_messages(pubsub)
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.close()
+    
+    async def _iter_messages(self, pubsub) -> AsyncIterator[Any]:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                yield orjson.loads(message["data"])
 
 cache = CacheManager()
@@ -0,0 +1,271 @@
+"""Processing job status, in Redis or in-process when Redis is disabled."""
+
+import asyncio
+import fcntl
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from multiprocessing.managers import BaseManager, DictProxy
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
+
+from app.core.cache import cache
+from app.core.config import settings
+
+# Jobs and their logs expire a day after the last update
+JOB_TTL = 24 * 60 * 60
+MAX_LOGS = 50
+
+# Submission lock only needs to outlive the enqueue; the TTL is a safety net
+# in case a worker dies before releasing it
+LOCK_TTL = 60
+
+# In-memory jobs that haven't been updated for this long are reported failed
+# (their worker died), so the video can be submitted again
+STALE_JOB_TIMEOUT = 10 * 60
+
+# Parsed tracking payloads are cached to skip disk reads on hot videos
+TRACKING_CACHE_TTL = 3600
+
+def tracking_cache_key(video_id: str) -> str:
+    return f"tracking:{video_id}"
+
+# How often in-memory subscribers check a job for changes
+MEMORY_POLL_INTERVAL = 0.5
+
+# Uploaded file extension, so the video path can be built without probing
+VIDEO_EXT_TTL = 7 * 24 * 60 * 60
+
+def video_ext_key(video_id: str) -> str:
+    return f"ext:{video_id}"
+
+class RedisJobStore:
+    """Stores each job as a Redis hash plus a capped log list."""
+    
+    def _key(self, video_id: str) -> str:
+        return f"job:{video_id}"
+    
+    def _logs_key(self, video_id: str) -> str:
+        return f"job:{video_id}:logs"
+    
+    def _lock_key(self, video_id: str) -> str:
+        return f"lock:process:{video_id}"
+    
+    def _events_channel(self, video_id: str) -> str:
+        return f"job:{video_id}:events"
+    
+    async def acquire_lock(self, video_id: str) -> Optional[str]:
+        """The lock's token, or None if someone else holds it."""
+        token = uuid.uuid4().hex
+        if await cache.acquire_lock(self._lock_key(video_id), token, LOCK_TTL):
+            return token
+        return None
+    
+    async def release_lock(self, video_id: str, token: str):
+        # Compare-and-delete: a job outliving LOCK_TTL must not drop a later submitter's lock
+        await cache.release_lock(self._lock_key(video_id), token)
+    
+    async def create(self, video_id: str, message: str):
+        await cache.delete(self._logs_key(video_id))
+        await self.update(video_id, status="processing", progress=0.0, message=message)
+    
+    async def update(self, video_id: str, **fields: Any):
+        await cache.hset(self._key(video_id), fields, expire=JOB_TTL)
+        await cache.publish(self._events_channel(video_id), fields)
+    
+    async def append_log(self, video_id: str, message: str):
+        await cache.push_capped(self._logs_key(video_id), message, MAX_LOGS, expire=JOB_TTL)
+        await cache.publish(self._events_channel(video_id), {"log": message})
+    
+    @asynccontextmanager
+    async def subscribe(self, video_id: str):
+        """Yields status deltas: changed fields, or {"log": message}."""
+        async with cache.subscribe(self._events_channel(video_id)) as events:
+            yield events
+    
+    async def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        status = await cache.hgetall(self._key(video_id))
+        if not status:
+            return None
+        
+        return {
+            "status": status["status"],
+            "progress": float(status.get("progress", 0.0)),
+            "message": status.get("message", ""),
+            "logs": await cache.lrange(self._logs_key(video_id))
+        }
+
+# Multi-worker runs without Redis share job state through a manager server
+class _SharedStateManager(BaseManager):
+    pass
+
+class _LockTable:
+    """
+    video_id -> (token, deadline). Each method runs whole on the manager
+    server (one call), so check-and-set and compare-and-delete are atomic.
+    """
+    
+    def __init__(self):
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._mutex = threading.Lock()
+    
+    def acquire(self, video_id: str, token: str, ttl: float) -> bool:
+        now = time.time()
+        with self._mutex:
+            held = self._locks.get(video_id)
+            # Like Redis' EX: a lock whose holder died can be taken over
+            if held is not None and held[1] > now:
+                return False
+            self._locks[video_id] = (token, now + ttl)
+            return True
+    
+    def release(self, video_id: str, token: str):
+        with self._mutex:
+            held = self._locks.get(video_id)
+            if held is not None and held[0] == token:
+                del self._locks[video_id]
+
+_shared_jobs: Dict[str, Dict[str, Any]] = {}
+_shared_locks = _LockTable()
+
+def _get_shared_jobs():
+    return _shared_jobs
+
+def _get_shared_locks():
+    return _shared_locks
+
+_SharedStateManager.register("get_jobs", callable=_get_shared_jobs, proxytype=DictProxy)
+_SharedStateManager.register("get_locks", callable=_get_shared_locks, exposed=("acquire", "release"))
+
+def _connect_shared_state(address: str):
+    """Connect to the shared state server, starting it if no worker has yet."""
+    host, port = address.rsplit(":", 1)
+    manager = _SharedStateManager(
+        address=(host, int(port)),
+        authkey=settings.SECRET_KEY.encode()
+    )
+    
+    # File lock so exactly one worker starts the server; lockf (not flock)
+    # so the forked server process does not inherit the lock
+    lock_path = os.path.join(settings.STORAGE_PATH, ".job_state.lock")
+    with open(lock_path, "w") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            manager.connect()
+        except ConnectionRefusedError:
+            manager.start()
+    
+    return manager.get_jobs(), manager.get_locks()
+
+class MemoryJobStore:
+    """
+    Job store for running without Redis.
+    
+    State lives in plain dicts, or in a multiprocessing manager server when
+    JOB_STATE_ADDRESS is set so every uvicorn worker sees the same jobs.
+    The server is a child of the worker that started it; if that worker
+    restarts, the others reconnect (starting a fresh, empty server).
+    Logs are a bounded deque, so appends never copy the list.
+    """
+    
+    def __init__(self, shared_address: str = ""):
+        self._shared_address = shared_address
+        self._state = None
+    
+    def _get_state(self):
+        if self._state is None:
+            if self._shared_address:
+                self._state = _connect_shared_state(self._shared_address)
+            else:
+                self._state = ({}, _LockTable())
+        return self._state
+    
+    def _with_state(self, fn):
+        """Call fn(jobs, locks), reconnecting once if the manager server went away."""
+        try:
+            return fn(*self._get_state())
+        except (EOFError, ConnectionError):
+            if not self._shared_address:
+                raise
+            self._state = None
+            return fn(*self._get_state())
+    
+    def _new_job(self, message: str) -> Dict[str, Any]:
+        return {
+            "status": "processing",
+            "progress": 0.0,
+            "message": message,
+            "logs": deque(maxlen=MAX_LOGS),
+            "updated_at": time.time()
+        }
+    
+    async def acquire_lock(self, video_id: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = self._with_state(lambda jobs, locks: locks.acquire(video_id, token, LOCK_TTL))
+        return token if acquired else None
+    
+    async def release_lock(self, video_id: str, token: str):
+        self._with_state(lambda jobs, locks: locks.release(video_id, token))
+    
+    async def create(self, video_id: str, message: str):
+        def write(jobs, locks):
+            jobs[video_id] = self._new_job(message)
+        self._with_state(write)
+    
+    # Manager proxies hand out copies, so entries are written back whole;
+    # each job has a single writer (its processing task). A job lost with a
+    # restarted server is recreated by its next write.
+    async def update(self, video_id: str, **fields: Any):
+        def write(jobs, locks):
+            job = jobs.get(video_id) or self._new_job("")
+            job.update(fields, updated_at=time.time())
+            jobs[video_id] = job
+        self._with_state(write)
+    
+    async def append_log(self, video_id: str, message: str):
+        def write(jobs, locks):
+            job = jobs.get(video_id) or self._new_job("")
+            job["logs"].append(message)
+            job["updated_at"] = time.time()
+            jobs[video_id] = job
+        self._with_state(write)
+    
+    async def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        job = self._with_state(lambda jobs, locks: jobs.get(video_id))
+        if job is None:
+            return None
+        
+        status, message = job["status"], job["message"]
+        # A worker that crashed mid-job never writes "failed"; don't report
+        # (and refuse to resubmit) a job that stopped updating as processing
+        if status == "processing" and time.time() - job["updated_at"] > STALE_JOB_TIMEOUT:
+            status, message = "failed", "Processing stopped responding"
+        
+        return {
+            "status": status,
+            "progress": job["progress"],
+            "message": message,
+            "logs": list(job["logs"])
+        }
+    
+    @asynccontextmanager
+    async def subscribe(self, video_id: str):
+        """Yields full status snapshots whenever the job changes."""
+        yield self._poll_changes(video_id)
+    
+    async def _poll_changes(self, video_id: str) -> AsyncIterator[Dict[str, Any]]:
+        # No pub/sub without Redis, so poll the (possibly shared) store
+        last = None
+        while True:
+            job = await self.get(video_id)
+            if job is not None and job != last:
+                last = job
+                yield job
+            await asyncio.sleep(MEMORY_POLL_INTERVAL)
+
+job_store = (
+    RedisJobStore() if cache.enabled
+    else MemoryJobStore(settings.JOB_STATE_ADDRESS)
+)
@@ -0,0 +1,82 @@
+"""S3/MinIO object storage for direct browser uploads."""
+
+import os
+from typing import Optional
+
+from app.core.config import settings
+
+# Queued jobs carry the object key, not a presigned URL that may expire first
+S3_URI_SCHEME = "s3://"
+
+class ObjectStorage:
+    """Issues presigned URLs so video bytes never pass through the API."""
+    
+    def __init__(self):
+        self._client = None
+    
+    def _get_client(self):
+        if self._client is None:
+            import boto3
+            
+            self._client = boto3.client(
+                "s3",
+                region_name=settings.S3_REGION or None,
+                endpoint_url=settings.S3_ENDPOINT_URL or None,
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None
+            )
+        return self._client
+    
+    def video_key(self, video_id: str, file_ext: str) -> str:
+        return f"videos/{video_id}{file_ext}"
+    
+    def locate_video(self, video_id: str, file_ext: Optional[str] = None) -> Optional[str]:
+        """Key of an uploaded video, listing by prefix when the extension is unknown."""
+        if file_ext is not None:
+            key = self.video_key(video_id, file_ext)
+            return key if self.exists(key) else None
+        
+        prefix = self.video_key(video_id, "")
+        response = self._get_client().list_objects_v2(Bucket=settings.S3_BUCKET, Prefix=prefix)
+        for obj in response.get("Contents", []):
+            if os.path.splitext(obj["Key"])[0] == prefix:
+                return obj["Key"]
+        return None
+    
+    def object_uri(self, key: str) -> str:
+        return f"{S3_URI_SCHEME}{key}"
+    
+    def resolve_path(self, path: str) -> str:
+        """Presign an s3:// object URI; local paths and URLs pass through."""
+        if path.startswith(S3_URI_SCHEME):
+            return self.presign_download(path[len(S3_URI_SCHEME):])
+        return path
+    
+    def presign_upload(self, key: str, content_type: Optional[str] = None) -> str:
+        params = {"Bucket": settings.S3_BUCKET, "Key": key}
+        if content_type:
+            # The client must then send the same Content-Type header
+            params["ContentType"] = content_type
+        return self._get_client().generate_presigned_url(
+            "put_object",
+            Params=params,
+            ExpiresIn=settings.PRESIGNED_URL_EXPIRY
+        )
+    
+    def presign_download(self, key: str) -> str:
+        return self._get_client().generate_presigned_url(
+            "get_object",
+            Params={"Bucket": settings.S3_BUCKET, "Key": key},
+            ExpiresIn=settings.PRESIGNED_URL_EXPIRY
+        )
+    
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        
+        try:
+            self._get_client().head_object(Bucket=settings.S3_BUCKET, Key=key)
+            return True
+        except ClientError:
+            return False
+
+storage = ObjectStorage()
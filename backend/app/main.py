@@ -1,10 +1,17 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import logging
 import os
 
 from app.core.config import settings
+from app.core.cache import cache
 from app.api import videos, events, health, process
+from app.services.product_search import close_session
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="VISOR API",
@@ -20,11 +27,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-os.makedirs(settings.STORAGE_PATH, exist_ok=True)
-os.makedirs(os.path.join(settings.STORAGE_PATH, "videos"), exist_ok=True)
-os.makedirs(os.path.join(settings.STORAGE_PATH, "frames"), exist_ok=True)
-os.makedirs(os.path.join(settings.STORAGE_PATH, "crops"), exist_ok=True)
-os.makedirs(os.path.join(settings.STORAGE_PATH, "tracking"), exist_ok=True)
+STORAGE_SUBDIRS = ("videos", "frames", "crops", "tracking")
+
+def ensure_storage_dirs(storage_path: str):
+    """Create the storage tree (subdirs create the root); cheap to repeat."""
+    for subdir in STORAGE_SUBDIRS:
+        os.makedirs(os.path.join(storage_path, subdir), exist_ok=True)
+
+ensure_storage_dirs(settings.STORAGE_PATH)
 
 app.mount("/static", StaticFiles(directory=settings.STORAGE_PATH), name="static")
 
@@ -46,6 +56,21 @@ async def startup_event():
     #     print(f"Warning: Database initialization failed: {e}")
     #     print("Running without database - using stateless mode")
     
+    # Without Redis, jobs run in this process, so load the models now
+    # rather than on the first processing request
+    if not cache.enabled:
+        from app.services.video_processor import get_video_processor
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, get_video_processor().preload
+            )
+        except Exception as e:
+            logger.warning("Model preload failed, loading on first use: %s", e)
+    
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_session()
+
 @app.get("/")
 async def root():
     return {
@@ -20,3 +20,19 @@ class VideoResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+class PresignUploadRequest(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+
+class PresignUploadResponse(BaseModel):
+    video_id: str
+    object_key: str
+    upload_url: str
+    expires_in: int
+
+class FinalizeUploadRequest(BaseModel):
+    video_id: str
+    object_key: str
+    title: Optional[str] = None
+    description: Optional[str] = None
@@ -1,13 +1,32 @@
-import subprocess
+import asyncio
+import bisect
 import os
+import re
+import shutil
+import tempfile
+import anyio
+from typing import Dict, List
 from app.core.config import settings
 from app.core.cache import cache
 
+FRAME_CACHE_TTL = 7200
+
+# showinfo logs one line per frame that survives the select filter
+_SHOWINFO_PTS_RE = re.compile(r"Parsed_showinfo.*pts_time:\s*([-\d.]+)")
+
 class FrameExtractor:
     def __init__(self):
         self.frames_dir = os.path.join(settings.STORAGE_PATH, "frames")
         os.makedirs(self.frames_dir, exist_ok=True)
     
+    def _frame_path(self, video_id: str, rounded_ts: int) -> str:
+        return os.path.join(self.frames_dir, f"{video_id}_{rounded_ts}.jpg")
+    
+    def _resolve_video_path(self, video_path: str) -> str:
+        if video_path.startswith('/static/'):
+            return os.path.join(settings.STORAGE_PATH, video_path.replace('/static/', ''))
+        return video_path
+    
     async def extract_frame(
         self,
         video_path: str,
@@ -17,15 +36,15 @@ class FrameExtractor:
         timestamp_sec = timestamp_ms / 1000.0
         rounded_ts = int(timestamp_ms / 100) * 100
         
-        frame_filename = f"{video_id}_{rounded_ts}.jpg"
-        frame_path = os.path.join(self.frames_dir, frame_filename)
+        frame_path = self._frame_path(video_id, rounded_ts)
         
+        # The file on disk is authoritative; skip ffmpeg entirely when it exists
         cache_key = f"frame:{video_id}:{rounded_ts}"
-        if await cache.exists(cache_key) and os.path.exists(frame_path):
+        if await anyio.Path(frame_path).exists():
+            await cache.set(cache_key, frame_path, expire=FRAME_CACHE_TTL)
             return frame_path
         
-        if video_path.startswith('/static/'):
-            video_path = os.path.join(settings.STORAGE_PATH, video_path.replace('/static/', ''))
+        video_path = self._resolve_video_path(video_path)
         
         cmd = [
             'ffmpeg',
@@ -37,10 +56,97 @@ class FrameExtractor:
             frame_path
         ]
         
-        subprocess.run(cmd, capture_output=True)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
         
-        if os.path.exists(frame_path):
-            await cache.set(cache_key, frame_path, expire=7200)
+        if await anyio.Path(frame_path).exists():
+            await cache.set(cache_key, frame_path, expire=FRAME_CACHE_TTL)
             return frame_path
         else:
             raise Exception(f"Failed to extract frame at {timestamp_ms}ms")
+    
+    async def extract_frames(
+        self,
+        video_path: str,
+        video_id: str,
+        timestamps_ms: List[int]
+    ) -> Dict[int, str]:
+        """
+        Extract many frames with a single ffmpeg decode pass.
+        
+        Frames already on disk are reused. Returns a map of each requested
+        timestamp to its frame path; timestamps past the end are omitted.
+        """
+        frame_paths = {}
+        pending = {}  # rounded_ts -> requested timestamps
+        
+        for timestamp_ms in timestamps_ms:
+            rounded_ts = int(timestamp_ms / 100) * 100
+            frame_path = self._frame_path(video_id, rounded_ts)
+            if await anyio.Path(frame_path).exists():
+                frame_paths[timestamp_ms] = frame_path
+            else:
+                pending.setdefault(rounded_ts, []).append(timestamp_ms)
+        
+        if not pending:
+            return frame_paths
+        
+        video_path = self._resolve_video_path(video_path)
+        targets = sorted(pending)
+        
+        # Select the first frame at or after each target time
+        select_expr = '+'.join(
+            f"gte(t,{ts / 1000.0})*(isnan(prev_pts)+lt(prev_pts*TB,{ts / 1000.0}))"
+            for ts in targets
+        )
+        
+        # ffmpeg numbers its outputs from 1, so each call gets its own
+        # directory; concurrent calls for one video can't overwrite each other
+        with tempfile.TemporaryDirectory(dir=self.frames_dir) as batch_dir:
+            batch_pattern = os.path.join(batch_dir, "%d.jpg")
+            cmd = [
+                'ffmpeg',
+                '-i', video_path,
+                '-vf', f"select='{select_expr}',showinfo",
+                '-vsync', '0',
+                '-q:v', '2',
+                '-f', 'image2',
+                '-y',
+                batch_pattern
+            ]
+            
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
+            
+            # Output files are numbered in the order showinfo reports them
+            selected_times = [
+                float(match.group(1))
+                for match in _SHOWINFO_PTS_RE.finditer(stderr.decode(errors='ignore'))
+            ]
+            
+            for rounded_ts in targets:
+                idx = bisect.bisect_left(selected_times, rounded_ts / 1000.0 - 1e-6)
+                if idx >= len(selected_times):
+                    continue
+                
+                batch_path = batch_pattern % (idx + 1)
+                if not await anyio.Path(batch_path).exists():
+                    continue
+                
+                frame_path = self._frame_path(video_id, rounded_ts)
+                # Nearby targets can resolve to the same decoded frame
+                await anyio.to_thread.run_sync(shutil.copyfile, batch_path, frame_path)
+                
+                await cache.set(f"frame:{video_id}:{rounded_ts}", frame_path, expire=FRAME_CACHE_TTL)
+                for timestamp_ms in pending[rounded_ts]:
+                    frame_paths[timestamp_ms] = frame_path
+        
+        return frame_paths
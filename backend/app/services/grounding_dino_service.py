@@ -1,10 +1,160 @@
 """Grounding DINO service for zero-shot object detection with text prompts."""
 
+import logging
+import os
 import torch
+import torch.nn.functional as F
 import numpy as np
-from PIL import Image
-from typing import List, Tuple, Dict
-import cv2
+from typing import List, Tuple, Dict, Sequence
+
+from app.core.config import settings
+from app.services.segmentation_service import COMPILE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Comprehensive product prompts for accurate classification
+PRODUCT_PROMPTS: Tuple[str, ...] = (
+    # Computers & Laptops
+    "laptop computer", "macbook laptop", "gaming laptop", "notebook computer",
+    "desktop computer", "pc tower", "computer monitor", "display screen",
+    "ultrawide monitor", "curved monitor",
+    
+    # Computer Peripherals
+    "computer keyboard", "mechanical keyboard", "gaming keyboard", "wireless keyboard",
+    "computer mouse", "gaming mouse", "wireless mouse", "trackpad",
+    "mouse pad", "keyboard wrist rest",
+    
+    # Mobile Devices
+    "smartphone", "mobile phone", "iphone", "android phone",
+    "tablet device", "ipad tablet", "e-reader", "kindle",
+    
+    # Audio Equipment
+    "headphones", "over-ear headphones", "wireless headphones",
+    "earbuds", "wireless earbuds", "airpods",
+    "bluetooth speaker", "desktop speakers", "speaker system",
+    "microphone", "usb microphone", "studio microphone",
+    "audio interface", "mixer",
+    
+    # Camera & Photography
+    "digital camera", "dslr camera", "mirrorless camera",
+    "webcam", "streaming camera",
+    "camera lens", "telephoto lens", "wide angle lens",
+    "camera tripod", "monopod", "gimbal stabilizer",
+    "ring light", "led panel light", "softbox",
+    
+    # Office Furniture
+    "office desk", "standing desk", "computer desk", "writing desk",
+    "office chair", "ergonomic chair", "gaming chair", "desk chair",
+    "filing cabinet", "bookshelf", "storage cabinet",
+    
+    # Lighting
+    "desk lamp", "table lamp", "floor lamp", "led lamp",
+    "ring light", "studio light", "neon sign",
+    
+    # Stationery & Books
+    "notebook", "journal", "planner", "notepad",
+    "book", "textbook", "hardcover book",
+    "pen", "pencil", "marker", "highlighter",
+    "sticky notes", "paper stack",
+    
+    # Fashion - Footwear
+    "sneakers", "running shoes", "athletic shoes",
+    "boots", "dress shoes", "sandals", "slippers",
+    
+    # Fashion - Clothing
+    "t-shirt", "polo shirt", "dress shirt", "button-up shirt",
+    "hoodie", "sweatshirt", "sweater", "cardigan",
+    "jacket", "leather jacket", "denim jacket", "blazer",
+    "jeans", "pants", "trousers", "shorts",
+    "dress", "skirt",
+    
+    # Fashion - Accessories
+    "baseball cap", "beanie", "fedora hat", "sun hat",
+    "backpack", "messenger bag", "tote bag", "duffel bag",
+    "handbag", "purse", "wallet", "clutch",
+    "belt", "tie", "bow tie", "scarf",
+    "wristwatch", "smartwatch", "fitness tracker",
+    "sunglasses", "eyeglasses", "reading glasses",
+    "jewelry", "necklace", "bracelet", "ring", "earrings",
+    
+    # Gaming
+    "game controller", "gaming console", "playstation", "xbox",
+    "gaming mouse", "gaming keyboard", "gaming headset",
+    "gaming chair", "racing sim wheel",
+    "nintendo switch", "handheld console",
+    
+    # Beverages & Drinkware
+    "water bottle", "insulated bottle", "sports bottle",
+    "coffee mug", "tea cup", "travel mug", "tumbler",
+    "wine glass", "beer glass", "champagne glass",
+    "thermos", "flask",
+    
+    # Home Decor
+    "potted plant", "succulent plant", "indoor plant",
+    "vase", "flower vase", "decorative vase",
+    "picture frame", "photo frame", "wall art",
+    "wall clock", "desk clock", "alarm clock",
+    "candle", "scented candle", "candle holder",
+    "throw pillow", "cushion", "decorative pillow",
+    "rug", "carpet", "floor mat",
+    
+    # Kitchen & Dining
+    "plate", "dinner plate", "bowl", "serving bowl",
+    "fork", "knife", "spoon", "chopsticks",
+    "cutting board", "kitchen knife", "chef knife",
+    "blender", "coffee maker", "toaster", "kettle",
+    "pan", "pot", "cooking pot", "frying pan",
+    
+    # Sports & Fitness
+    "dumbbell", "kettlebell", "weight plate",
+    "yoga mat", "exercise mat", "foam roller",
+    "resistance band", "jump rope", "pull-up bar",
+    "tennis racket", "basketball", "soccer ball", "football",
+    "bicycle", "mountain bike", "road bike",
+    "skateboard", "longboard", "scooter",
+    
+    # Tools & Equipment
+    "screwdriver", "hammer", "wrench", "pliers",
+    "drill", "power drill", "tape measure",
+    "toolbox", "tool kit",
+    
+    # Beauty & Personal Care
+    "perfume bottle", "cologne bottle",
+    "makeup brush", "cosmetic bag",
+    "hair dryer", "hair straightener", "curling iron",
+    "electric shaver", "razor",
+    
+    # Toys & Collectibles
+    "action figure", "toy car", "stuffed animal",
+    "lego set", "building blocks",
+    "board game", "puzzle",
+    "collectible figure", "funko pop",
+    
+    # Musical Instruments
+    "guitar", "acoustic guitar", "electric guitar",
+    "keyboard", "piano", "digital piano",
+    "drum set", "drum pad",
+    "ukulele", "violin", "saxophone",
+    
+    # Storage & Organization
+    "storage box", "plastic bin", "storage container",
+    "drawer organizer", "cable organizer",
+    "laundry basket", "hamper",
+    
+    # Pet Supplies
+    "pet bed", "dog bed", "cat bed",
+    "pet bowl", "food bowl", "water bowl",
+    "pet toy", "dog toy", "cat toy",
+    "pet carrier", "leash", "collar"
+)
+
+# Images per forward in detect_objects_batch, and a rough upper bound on
+# the GPU memory one 768x768 image needs through the FP16 forward
+BATCH_SIZE = 8
+BATCH_IMAGE_BYTES = 256 * 1024 * 1024
+
+# Loaded (processor, model) pairs keyed by (model_id, device)
+_MODEL_CACHE: Dict[Tuple[str, str], Tuple] = {}
 
 class GroundingDINOService:
     """
@@ -16,6 +166,10 @@ class GroundingDINOService:
         self.device = self._get_device()
         self.model = None
         self.processor = None
+        self._cached_text_embeds = None
+        self._cached_text_key = None
+        self._staging = None  # pinned host buffer for frame uploads (CUDA)
+        self._staging_free = None
         
     def _get_device(self):
         """Get the best available device."""
@@ -26,26 +180,190 @@ class GroundingDINOService:
         else:
             return torch.device("cpu")
     
+    def preload(self):
+        """Load the model ahead of the first request (startup / worker init)."""
+        self._load_model()
+    
     def _load_model(self):
         """Load OWL-ViT model for zero-shot object detection."""
         if self.model is not None:
             return
         
+        model_id = "google/owlvit-base-patch32"
+        cache_key = (model_id, str(self.device))
+        
+        # Instances on the same device share one copy of the weights
+        if cache_key in _MODEL_CACHE:
+            self.processor, self.model = _MODEL_CACHE[cache_key]
+            self._init_preprocessing()
+            return
+        
         try:
             from transformers import OwlViTProcessor, OwlViTForObjectDetection
             
-            print("Loading OWL-ViT model (zero-shot object detection)...")
-            model_id = "google/owlvit-base-patch32"
+            logger.info("Loading OWL-ViT model (zero-shot object detection)...")
+            
+            if self.device.type == "cuda":
+                # Inputs are always resized to input_size, so the autotuned
+                # kernels are picked once; TF32 matmuls on Ampere and newer
+                torch.backends.cudnn.benchmark = True
+                torch.set_float32_matmul_precision("high")
             
             self.processor = OwlViTProcessor.from_pretrained(model_id)
             self.model = OwlViTForObjectDetection.from_pretrained(model_id)
             self.model.to(self.device)
+            if self.device.type == "cuda":
+                # Keep FP16 weights resident: half the weight traffic, and
+                # autocast no longer re-casts every weight on each forward
+                self.model.half()
+                # NHWC lets cuDNN pick tensor-core kernels for the patch conv
+                self.model.owlvit.vision_model.embeddings.patch_embedding.to(memory_format=torch.channels_last)
+            self.model.eval()
+            
+            self._init_preprocessing()
+            
+            if self.device.type == "cuda":
+                self._compile_vision_model()
+                self._warmup()
+            elif settings.OWLVIT_CPU_QUANTIZE:
+                self._quantize_for_cpu()
             
-            print(f"Loaded OWL-ViT on {self.device}")
+            _MODEL_CACHE[cache_key] = (self.processor, self.model)
+            logger.info("Loaded OWL-ViT on %s", self.device)
         except Exception as e:
-            print(f"Error loading OWL-ViT: {e}")
+            self.model = None
+            logger.error("Error loading OWL-ViT: %s", e)
             raise
     
+    def _init_preprocessing(self):
+        """Normalization constants on device for tensor preprocessing."""
+        image_processor = self.processor.image_processor
+        self.image_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, 3, 1, 1)
+        self.image_std = torch.tensor(image_processor.image_std, device=self.device).view(1, 3, 1, 1)
+        self.input_size = (image_processor.size["height"], image_processor.size["width"])
+        self.dtype = next(self.model.parameters()).dtype
+        self.memory_format = torch.channels_last if self.device.type == "cuda" else torch.contiguous_format
+        
+        if self.device.type == "cuda":
+            self._compile_preprocessing()
+    
+    def _compile_preprocessing(self):
+        """
+        Fuse the per-frame elementwise preprocessing (rescale, clamp, flip,
+        normalize, cast) around the resize. Frame size is fixed within a
+        video, so it is compiled statically, once per resolution.
+        """
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+        try:
+            preprocess = torch.compile(self._preprocess, dynamic=False)
+            # Surface compile errors now; real frame sizes compile on first use
+            with torch.inference_mode():
+                preprocess(torch.zeros((*self.input_size, 3), dtype=torch.uint8, device=self.device))
+            self._preprocess = preprocess
+        except Exception as e:
+            logger.warning("torch.compile unavailable, using eager preprocessing: %s", e)
+    
+    def _compile_batch_size(self) -> int:
+        """Batch size the compiled backbone is traced for: process_video's detection batch."""
+        return max(1, min(settings.DETECTION_BATCH_SIZE, BATCH_SIZE))
+    
+    def _compile_vision_model(self):
+        """
+        Compile the vision backbone so inductor can fuse its attention blocks.
+        Inputs are always resized to input_size and smaller batches are padded
+        to _compile_batch_size (see _detect_batch), so shapes are static.
+        Kernels go to the persistent inductor cache, so restarts reuse them.
+        """
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+        try:
+            self.model.owlvit.vision_model = torch.compile(
+                self.model.owlvit.vision_model,
+                mode="reduce-overhead",
+                dynamic=False,
+                fullgraph=False
+            )
+            
+            # Pay the one-time compile cost now rather than on the first request
+            dummy_pixels = torch.zeros(
+                self._compile_batch_size(), 3, *self.input_size, device=self.device, dtype=self.dtype
+            )
+            dummy_pixels = dummy_pixels.contiguous(memory_format=self.memory_format)
+            with torch.inference_mode():
+                self.model.owlvit.vision_model(pixel_values=dummy_pixels)
+        except Exception as e:
+            logger.warning("torch.compile unavailable, using eager OWL-ViT: %s", e)
+            vision_model = self.model.owlvit.vision_model
+            self.model.owlvit.vision_model = getattr(vision_model, "_orig_mod", vision_model)
+    
+    def _quantize_for_cpu(self):
+        """
+        Dynamic int8 quantization of the Linear layers in both towers.
+        The CPU forward is dominated by these matmuls; the detection heads stay FP32.
+        """
+        owlvit = self.model.owlvit
+        owlvit.vision_model = torch.ao.quantization.quantize_dynamic(
+            owlvit.vision_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        owlvit.text_model = torch.ao.quantization.quantize_dynamic(
+            owlvit.text_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        logger.info("Quantized OWL-ViT to int8 for CPU inference")
+    
+    def _warmup(self):
+        """
+        Run the full detection path on a dummy batch so the first request
+        doesn't pay CUDA lazy init (the second forward still pays some).
+        """
+        dummy_images = [np.zeros((*self.input_size, 3), dtype=np.uint8)] * self._compile_batch_size()
+        text_embeds = self._encode_text(["object"])
+        for _ in range(2):
+            self._detect_batch(dummy_images, text_embeds, score_threshold=1.0)
+        torch.cuda.synchronize(self.device)
+    
+    def _upload_frames(self, images: List[np.ndarray]) -> List[torch.Tensor]:
+        """
+        Move BGR uint8 frames to the device. On CUDA, same-sized frames are
+        packed into a reused pinned buffer and sent in one async copy.
+        """
+        if self.device.type != "cuda" or any(image.shape != images[0].shape for image in images):
+            return [torch.from_numpy(image).to(self.device) for image in images]
+        
+        frame_shape = images[0].shape
+        if self._staging is None or self._staging.shape[1:] != frame_shape:
+            self._staging = torch.empty((BATCH_SIZE, *frame_shape), dtype=torch.uint8, pin_memory=True)
+            self._staging_free = None
+        
+        # Don't overwrite the buffer while the previous copy may still read it
+        if self._staging_free is not None:
+            self._staging_free.synchronize()
+        staging = self._staging[:len(images)]
+        staging_array = staging.numpy()
+        for i, image in enumerate(images):
+            staging_array[i] = image
+        
+        frames = staging.to(self.device, non_blocking=True)
+        self._staging_free = torch.cuda.Event()
+        self._staging_free.record()
+        return list(frames)
+    
+    def _preprocess(self, frame: torch.Tensor) -> torch.Tensor:
+        """
+        Turn a BGR uint8 frame (HWC, on the device) into normalized pixel_values.
+        Mirrors OwlViTImageProcessor (resize to input size, rescale, normalize)
+        but runs as tensor ops instead of PIL on the CPU.
+        """
+        pixels = frame.permute(2, 0, 1).unsqueeze(0).float().div_(255.0)
+        pixels = F.interpolate(
+            pixels,
+            size=self.input_size,
+            mode="bicubic",
+            align_corners=False,
+            antialias=True
+        ).clamp_(0.0, 1.0)
+        # BGR -> RGB on the resized tensor, so it never touches full-res pixels
+        pixels = pixels.flip(1)
+        return ((pixels - self.image_mean) / self.image_std).to(self.dtype)
+    
     def detect_objects(
         self,
         image: np.ndarray,
@@ -65,273 +383,225 @@ class GroundingDINOService:
         """
         self._load_model()
         
-        # Convert BGR to RGB
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_pil = Image.fromarray(image_rgb)
-        
+        text_embeds = self._encode_text(text_prompts)
+        return self.detect_objects_with_cached_text(image, text_embeds, text_prompts, score_threshold)
+    
+    def _encode_text(self, text_prompts: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Run the text tower once; returns (query_embeds [1,Q,D], query_mask [1,Q])."""
         # Prepare text queries (OWL-ViT uses list of queries)
         text_queries = [[prompt] for prompt in text_prompts]
-        
-        # Process inputs
-        inputs = self.processor(
+        text_inputs = self.processor(
             text=text_queries,
-            images=image_pil,
             return_tensors="pt"
         ).to(self.device)
         
-        # Run detection
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+        with torch.inference_mode():
+            query_embeds = self.model.owlvit.get_text_features(**text_inputs)
+        
+        query_mask = text_inputs["input_ids"][:, 0] > 0
+        return query_embeds.unsqueeze(0), query_mask.unsqueeze(0)
+    
+    def _get_product_text_embeds(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Product prompt embeddings, recomputed only when the prompts change."""
+        self._load_model()
+        prompts = tuple(PRODUCT_PROMPTS)
+        if self._cached_text_key != prompts:
+            self._cached_text_embeds = self._encode_text(list(prompts))
+            self._cached_text_key = prompts
+        return self._cached_text_embeds
+    
+    def detect_objects_with_cached_text(
+        self,
+        image: np.ndarray,
+        text_embeds: Tuple[torch.Tensor, torch.Tensor],
+        text_prompts: List[str],
+        score_threshold: float = 0.15
+    ) -> List[Dict]:
+        """
+        Detect objects using precomputed prompt embeddings from _encode_text.
+        Only the vision tower and the detection heads run per image.
+        """
+        boxes, scores, labels = self._detect(image, text_embeds, score_threshold)
+        return self._to_detections(boxes, scores, labels, text_prompts)
+    
+    def _detect(
+        self,
+        image: np.ndarray,
+        text_embeds: Tuple[torch.Tensor, torch.Tensor],
+        score_threshold: float
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Run detection and return (boxes xyxy [N,4], scores [N], labels [N]) on device."""
+        return self._detect_batch([image], text_embeds, score_threshold)[0]
+    
+    def _detect_batch(
+        self,
+        images: List[np.ndarray],
+        text_embeds: Tuple[torch.Tensor, torch.Tensor],
+        score_threshold: float
+    ) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """Run one forward over a stack of images; returns per-image (boxes, scores, labels)."""
+        from transformers.models.owlvit.modeling_owlvit import OwlViTObjectDetectionOutput
+        
+        self._load_model()
+        
+        # Images go through the tensor pipeline and are stacked to [B,3,H,W]
+        pixel_values = torch.cat([self._preprocess(frame) for frame in self._upload_frames(images)])
+        pixel_values = pixel_values.contiguous(memory_format=self.memory_format)
+        num_images = pixel_values.shape[0]
+        
+        # The compiled backbone is specialized to one batch size; pad partial
+        # batches (e.g. the last one of a video) instead of recompiling
+        vision_model = self.model.owlvit.vision_model
+        if hasattr(vision_model, "_orig_mod") and num_images < self._compile_batch_size():
+            padding = pixel_values.new_zeros((self._compile_batch_size() - num_images, *pixel_values.shape[1:]))
+            pixel_values = torch.cat([pixel_values, padding]).contiguous(memory_format=self.memory_format)
+        batch_size = pixel_values.shape[0]
+        
+        # The same prompts apply to every image in the batch
+        query_embeds, query_mask = text_embeds
+        query_embeds = query_embeds.expand(batch_size, -1, -1)
+        query_mask = query_mask.expand(batch_size, -1)
+        
+        # Same as OwlViTForObjectDetection.forward minus the text tower;
+        # FP16 autocast on CUDA only (it can hang on CPU)
+        with torch.inference_mode(), torch.autocast(
+            device_type=self.device.type,
+            dtype=torch.float16,
+            enabled=(self.device.type == "cuda")
+        ):
+            feature_map, _ = self.model.image_embedder(pixel_values=pixel_values)
+            _, num_patches_h, num_patches_w, hidden_dim = feature_map.shape
+            image_feats = feature_map.reshape(batch_size, num_patches_h * num_patches_w, hidden_dim)
+            
+            pred_logits, _ = self.model.class_predictor(image_feats, query_embeds, query_mask)
+            pred_boxes = self.model.box_predictor(image_feats, feature_map)
+        
+        # Box decoding stays in FP32; padding rows are dropped
+        outputs = OwlViTObjectDetectionOutput(
+            logits=pred_logits[:num_images].float(),
+            pred_boxes=pred_boxes[:num_images].float()
+        )
         
         # Post-process results
-        target_sizes = torch.tensor([image_pil.size[::-1]]).to(self.device)
+        target_sizes = torch.tensor([image.shape[:2] for image in images], device=self.device)
         results = self.processor.post_process_object_detection(
             outputs=outputs,
             threshold=score_threshold,
             target_sizes=target_sizes
-        )[0]
+        )
         
-        # Format detections
-        detections = []
-        
-        boxes = results["boxes"].cpu().numpy()
-        scores = results["scores"].cpu().numpy()
-        labels = results["labels"].cpu().numpy()
-        
-        for box, score, label_idx in zip(boxes, scores, labels):
-            x1, y1, x2, y2 = box
-            
-            # Get the label text from the prompt index
-            label = text_prompts[label_idx] if label_idx < len(text_prompts) else f"object_{label_idx}"
-            
-            detection = {
-                'bbox': {
-                    'x': float(x1),
-                    'y': float(y1),
-                    'width': float(x2 - x1),
-                    'height': float(y2 - y1)
-                },
-                'label': label,
-                'confidence': float(score)
-            }
-            
-            detections.append(detection)
+        return [(r["boxes"], r["scores"], r["labels"]) for r in results]
+    
+    def _max_batch_size(self) -> int:
+        """Largest batch that fits in free GPU memory, capped at BATCH_SIZE."""
+        if self.device.type != "cuda":
+            return BATCH_SIZE
         
-        return detections
+        free_bytes, _ = torch.cuda.mem_get_info(self.device)
+        return max(1, min(BATCH_SIZE, free_bytes // BATCH_IMAGE_BYTES))
     
-    def _apply_nms(self, detections: List[Dict], iou_threshold: float = 0.5) -> List[Dict]:
+    def detect_objects_batch(
+        self,
+        images: List[np.ndarray],
+        text_prompts: List[str],
+        score_threshold: float = 0.15
+    ) -> List[List[Dict]]:
         """
-        Apply Non-Maximum Suppression to remove overlapping detections.
-        Keeps the detection with highest confidence when boxes overlap significantly.
+        Detect objects in several images at once.
+        Returns one detection list per image, in the same order as detect_objects.
         """
-        if len(detections) == 0:
-            return detections
-        
-        # Sort by confidence (descending)
-        detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)
-        
-        keep = []
-        
-        for i, det in enumerate(detections):
-            # Check if this detection overlaps significantly with any kept detection
-            should_keep = True
-            
-            for kept_det in keep:
-                iou = self._calculate_iou(det['bbox'], kept_det['bbox'])
-                
-                # If high overlap, only keep if it's a different class with high confidence
-                if iou > iou_threshold:
-                    # Keep both if they're different classes and both have good confidence
-                    if det['label'] != kept_det['label'] and det['confidence'] > 0.25:
-                        continue
-                    else:
-                        should_keep = False
-                        break
-            
-            if should_keep:
-                keep.append(det)
+        self._load_model()
         
-        return keep
-    
-    def _calculate_iou(self, bbox1: Dict, bbox2: Dict) -> float:
-        """Calculate Intersection over Union between two bounding boxes."""
-        x1_min = bbox1['x']
-        y1_min = bbox1['y']
-        x1_max = bbox1['x'] + bbox1['width']
-        y1_max = bbox1['y'] + bbox1['height']
+        text_embeds = self._encode_text(text_prompts)
+        batch_size = self._max_batch_size()
         
-        x2_min = bbox2['x']
-        y2_min = bbox2['y']
-        x2_max = bbox2['x'] + bbox2['width']
-        y2_max = bbox2['y'] + bbox2['height']
+        detections = []
+        for start in range(0, len(images), batch_size):
+            for boxes, scores, labels in self._detect_batch(
+                images[start:start + batch_size], text_embeds, score_threshold
+            ):
+                detections.append(self._to_detections(boxes, scores, labels, text_prompts))
         
-        # Calculate intersection
-        x_inter_min = max(x1_min, x2_min)
-        y_inter_min = max(y1_min, y2_min)
-        x_inter_max = min(x1_max, x2_max)
-        y_inter_max = min(y1_max, y2_max)
+        return detections
+    
+    def _to_detections(
+        self,
+        boxes: torch.Tensor,
+        scores: torch.Tensor,
+        labels: torch.Tensor,
+        text_prompts: Sequence[str]
+    ) -> List[Dict]:
+        """
+        Convert detection tensors to the public dict format.
+        Boxes are turned into (x, y, width, height) on device and packed with
+        scores and labels, so only the kept rows cross to the host, in one copy.
+        """
+        boxes_xywh = torch.cat([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], dim=1)
+        # Label indices are small, so they round-trip through float exactly
+        rows = torch.cat([boxes_xywh, scores[:, None], labels[:, None].float()], dim=1).tolist()
+        num_prompts = len(text_prompts)
         
-        if x_inter_max < x_inter_min or y_inter_max < y_inter_min:
-            return 0.0
+        detections = []
+        for x, y, width, height, score, label_idx in rows:
+            label_idx = int(label_idx)
+            detections.append({
+                'bbox': {'x': x, 'y': y, 'width': width, 'height': height},
+                # Get the label text from the prompt index
+                'label': text_prompts[label_idx] if label_idx < num_prompts else f"object_{label_idx}",
+                'confidence': score
+            })
         
-        intersection = (x_inter_max - x_inter_min) * (y_inter_max - y_inter_min)
+        return detections
+    
+    def _apply_nms(
+        self,
+        boxes: torch.Tensor,
+        scores: torch.Tensor,
+        labels: torch.Tensor,
+        iou_threshold: float = 0.5
+    ) -> torch.Tensor:
+        """
+        Apply Non-Maximum Suppression to remove overlapping detections.
+        Returns the kept indices, highest confidence first.
+        """
+        from torchvision.ops import batched_nms, box_iou
         
-        # Calculate union
-        area1 = bbox1['width'] * bbox1['height']
-        area2 = bbox2['width'] * bbox2['height']
-        union = area1 + area2 - intersection
+        # Same-class overlaps: keep the highest confidence box
+        keep = batched_nms(boxes, scores, labels, iou_threshold)
         
-        if union == 0:
-            return 0.0
+        # Different-class overlaps: keep both only if the weaker one has good confidence
+        overlaps = box_iou(boxes[keep], boxes[keep]) > iou_threshold
+        overlaps_stronger = overlaps.triu(diagonal=1).any(dim=0)
+        weak = scores[keep] <= 0.25
         
-        return intersection / union
+        return keep[~(overlaps_stronger & weak)]
     
     def detect_products(self, image: np.ndarray) -> List[Dict]:
         """
         Detect common products in an image.
         Uses predefined product categories.
         """
+        return self.detect_products_batch([image])[0]
+    
+    def detect_products_batch(self, images: List[np.ndarray]) -> List[List[Dict]]:
+        """
+        Detect common products in several images with batched forwards.
+        Returns one detection list per image, same as detect_products.
+        """
+        # Prompt embeddings are computed once
+        text_embeds = self._get_product_text_embeds()
+        batch_size = self._max_batch_size()
         
-        # Comprehensive product prompts for accurate classification
-        product_prompts = [
-            # Computers & Laptops
-            "laptop computer", "macbook laptop", "gaming laptop", "notebook computer",
-            "desktop computer", "pc tower", "computer monitor", "display screen",
-            "ultrawide monitor", "curved monitor",
-            
-            # Computer Peripherals
-            "computer keyboard", "mechanical keyboard", "gaming keyboard", "wireless keyboard",
-            "computer mouse", "gaming mouse", "wireless mouse", "trackpad",
-            "mouse pad", "keyboard wrist rest",
-            
-            # Mobile Devices
-            "smartphone", "mobile phone", "iphone", "android phone",
-            "tablet device", "ipad tablet", "e-reader", "kindle",
-            
-            # Audio Equipment
-            "headphones", "over-ear headphones", "wireless headphones",
-            "earbuds", "wireless earbuds", "airpods",
-            "bluetooth speaker", "desktop speakers", "speaker system",
-            "microphone", "usb microphone", "studio microphone",
-            "audio interface", "mixer",
-            
-            # Camera & Photography
-            "digital camera", "dslr camera", "mirrorless camera",
-            "webcam", "streaming camera",
-            "camera lens", "telephoto lens", "wide angle lens",
-            "camera tripod", "monopod", "gimbal stabilizer",
-            "ring light", "led panel light", "softbox",
-            
-            # Office Furniture
-            "office desk", "standing desk", "computer desk", "writing desk",
-            "office chair", "ergonomic chair", "gaming chair", "desk chair",
-            "filing cabinet", "bookshelf", "storage cabinet",
-            
-            # Lighting
-            "desk lamp", "table lamp", "floor lamp", "led lamp",
-            "ring light", "studio light", "neon sign",
-            
-            # Stationery & Books
-            "notebook", "journal", "planner", "notepad",
-            "book", "textbook", "hardcover book",
-            "pen", "pencil", "marker", "highlighter",
-            "sticky notes", "paper stack",
-            
-            # Fashion - Footwear
-            "sneakers", "running shoes", "athletic shoes",
-            "boots", "dress shoes", "sandals", "slippers",
-            
-            # Fashion - Clothing
-            "t-shirt", "polo shirt", "dress shirt", "button-up shirt",
-            "hoodie", "sweatshirt", "sweater", "cardigan",
-            "jacket", "leather jacket", "denim jacket", "blazer",
-            "jeans", "pants", "trousers", "shorts",
-            "dress", "skirt",
-            
-            # Fashion - Accessories
-            "baseball cap", "beanie", "fedora hat", "sun hat",
-            "backpack", "messenger bag", "tote bag", "duffel bag",
-            "handbag", "purse", "wallet", "clutch",
-            "belt", "tie", "bow tie", "scarf",
-            "wristwatch", "smartwatch", "fitness tracker",
-            "sunglasses", "eyeglasses", "reading glasses",
-            "jewelry", "necklace", "bracelet", "ring", "earrings",
-            
-            # Gaming
-            "game controller", "gaming console", "playstation", "xbox",
-            "gaming mouse", "gaming keyboard", "gaming headset",
-            "gaming chair", "racing sim wheel",
-            "nintendo switch", "handheld console",
-            
-            # Beverages & Drinkware
-            "water bottle", "insulated bottle", "sports bottle",
-            "coffee mug", "tea cup", "travel mug", "tumbler",
-            "wine glass", "beer glass", "champagne glass",
-            "thermos", "flask",
-            
-            # Home Decor
-            "potted plant", "succulent plant", "indoor plant",
-            "vase", "flower vase", "decorative vase",
-            "picture frame", "photo frame", "wall art",
-            "wall clock", "desk clock", "alarm clock",
-            "candle", "scented candle", "candle holder",
-            "throw pillow", "cushion", "decorative pillow",
-            "rug", "carpet", "floor mat",
-            
-            # Kitchen & Dining
-            "plate", "dinner plate", "bowl", "serving bowl",
-            "fork", "knife", "spoon", "chopsticks",
-            "cutting board", "kitchen knife", "chef knife",
-            "blender", "coffee maker", "toaster", "kettle",
-            "pan", "pot", "cooking pot", "frying pan",
-            
-            # Sports & Fitness
-            "dumbbell", "kettlebell", "weight plate",
-            "yoga mat", "exercise mat", "foam roller",
-            "resistance band", "jump rope", "pull-up bar",
-            "tennis racket", "basketball", "soccer ball", "football",
-            "bicycle", "mountain bike", "road bike",
-            "skateboard", "longboard", "scooter",
-            
-            # Tools & Equipment
-            "screwdriver", "hammer", "wrench", "pliers",
-            "drill", "power drill", "tape measure",
-            "toolbox", "tool kit",
-            
-            # Beauty & Personal Care
-            "perfume bottle", "cologne bottle",
-            "makeup brush", "cosmetic bag",
-            "hair dryer", "hair straightener", "curling iron",
-            "electric shaver", "razor",
-            
-            # Toys & Collectibles
-            "action figure", "toy car", "stuffed animal",
-            "lego set", "building blocks",
-            "board game", "puzzle",
-            "collectible figure", "funko pop",
-            
-            # Musical Instruments
-            "guitar", "acoustic guitar", "electric guitar",
-            "keyboard", "piano", "digital piano",
-            "drum set", "drum pad",
-            "ukulele", "violin", "saxophone",
-            
-            # Storage & Organization
-            "storage box", "plastic bin", "storage container",
-            "drawer organizer", "cable organizer",
-            "laundry basket", "hamper",
-            
-            # Pet Supplies
-            "pet bed", "dog bed", "cat bed",
-            "pet bowl", "food bowl", "water bowl",
-            "pet toy", "dog toy", "cat toy",
-            "pet carrier", "leash", "collar"
-        ]
-        
-        # Detect with higher threshold
-        detections = self.detect_objects(image, product_prompts, score_threshold=0.2)
-        
-        # Apply Non-Maximum Suppression to remove overlapping detections
-        detections = self._apply_nms(detections, iou_threshold=0.5)
+        detections = []
+        for start in range(0, len(images), batch_size):
+            # Detect with higher threshold
+            for boxes, scores, labels in self._detect_batch(
+                images[start:start + batch_size], text_embeds, score_threshold=0.2
+            ):
+                # NMS runs on the raw tensors; only survivors become dicts
+                keep = self._apply_nms(boxes, scores, labels, iou_threshold=0.5)
+                detections.append(
+                    self._to_detections(boxes[keep], scores[keep], labels[keep], PRODUCT_PROMPTS)
+                )
         
         return detections
@@ -1,11 +1,137 @@
 """Real product search service using Google Shopping API."""
 
 import os
-import requests
-from typing import List, Optional
+import re
+import asyncio
+import aiohttp
+import orjson
+from cachetools import TTLCache
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from app.schemas.product import Product
 from app.core.config import settings
 
+SERPAPI_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+# Anything that isn't part of the number (currency symbols, commas, spaces)
+_PRICE_RE = re.compile(r'[^\d.]+')
+
+# Shared session so repeated SerpAPI calls reuse pooled TLS connections.
+# A session is bound to the event loop it was created on; Celery tasks
+# each run their own loop, so it is recreated when the loop changes.
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    # No await between the check and the assignment, so this cannot race
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=16)
+        )
+        _session_loop = loop
+    return _session
+
+async def close_session():
+    """Close the shared HTTP session (call on shutdown / end of task)."""
+    global _session, _session_loop
+    if _session is not None and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+# Categories repeat heavily across frames and videos, so SerpAPI results
+# are kept for an hour, keyed by (category, top_k)
+SERP_CACHE_TTL = 3600
+_serp_cache: TTLCache = TTLCache(maxsize=1024, ttl=SERP_CACHE_TTL)
+
+# Per-key locks so concurrent identical queries make a single request.
+# Like the session, locks are tied to the loop and reset when it changes.
+_serp_locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+_serp_locks_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_serp_lock(key: Tuple[str, int]) -> asyncio.Lock:
+    global _serp_locks_loop
+    loop = asyncio.get_running_loop()
+    if _serp_locks_loop is not loop:
+        _serp_locks.clear()
+        _serp_locks_loop = loop
+    lock = _serp_locks.get(key)
+    if lock is None:
+        lock = _serp_locks[key] = asyncio.Lock()
+    return lock
+
+# Mock results only depend on (category, top_k), so each is built once
+@lru_cache(maxsize=1024)
+def _mock_products(category: str, top_k: int) -> Tuple[Product, ...]:
+    """Mock products for a category, used when no SerpAPI key is set."""
+    # Mock product data based on category
+    mock_products = {
+        "sneakers": [
+            {
+                "title": f"Classic {category.title()}",
+                "brand": "Nike",
+                "price": 89.99,
+                "image_url": "https://images.unsplash.com/photo-1542291026-7eec264c27ff",
+                "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
+            },
+            {
+                "title": f"Premium {category.title()}",
+                "brand": "Adidas",
+                "price": 110.00,
+                "image_url": "https://images.unsplash.com/photo-1549298916-b41d501d3772",
+                "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
+            }
+        ],
+        "hoodie": [
+            {
+                "title": f"Comfortable {category.title()}",
+                "brand": "Champion",
+                "price": 65.00,
+                "image_url": "https://images.unsplash.com/photo-1556821840-3a63f95609a7",
+                "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
+            }
+        ],
+        "jeans": [
+            {
+                "title": f"Denim {category.title()}",
+                "brand": "Levi's",
+                "price": 79.99,
+                "image_url": "https://images.unsplash.com/photo-1542272604-787c3835535d",
+                "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
+            }
+        ]
+    }
+    
+    # Get mock products for this category or use generic
+    category_products = mock_products.get(category, [
+        {
+            "title": f"{category.title()}",
+            "brand": "Generic Brand",
+            "price": 50.00,
+            "image_url": "https://images.unsplash.com/photo-1523275335684-37898b6baf30",
+            "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
+        }
+    ])
+    
+    products = []
+    for i, mock_data in enumerate(category_products[:top_k]):
+        product = Product(
+            product_id=f"mock-{category}-{i}",
+            title=mock_data["title"],
+            brand=mock_data["brand"],
+            price=mock_data["price"],
+            currency="USD",
+            image_url=mock_data["image_url"],
+            buy_url=mock_data["buy_url"],
+            category=category,
+            confidence=0.70  # Lower confidence for mock data
+        )
+        products.append(product)
+    
+    return tuple(products)
+
 class ProductSearchService:
     """Search for real products on the internet using Google Shopping."""
     
@@ -39,116 +165,62 @@ class ProductSearchService:
     async def _search_with_serpapi(self, category: str, top_k: int) -> List[Product]:
         """Search using SerpAPI (Google Shopping)."""
         
-        try:
-            url = "https://serpapi.com/search"
-            params = {
-                "engine": "google_shopping",
-                "q": category,
-                "api_key": self.serpapi_key,
-                "num": top_k
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            products = []
-            shopping_results = data.get("shopping_results", [])
-            
-            for result in shopping_results[:top_k]:
-                product = Product(
-                    product_id=result.get("product_id", ""),
-                    title=result.get("title", "Unknown Product"),
-                    brand=result.get("source", ""),
-                    price=self._extract_price(result.get("price", "")),
-                    currency="USD",
-                    image_url=result.get("thumbnail", ""),
-                    buy_url=result.get("link", ""),
-                    category=category,
-                    confidence=0.85  # High confidence for real search results
-                )
-                products.append(product)
-            
-            return products
+        key = (category.lower(), top_k)
+        cached = _serp_cache.get(key)
+        if cached is not None:
+            return list(cached)
+        
+        async with _get_serp_lock(key):
+            # Another request may have filled the cache while we waited
+            cached = _serp_cache.get(key)
+            if cached is not None:
+                return list(cached)
             
-        except Exception as e:
-            print(f"SerpAPI search failed: {e}")
-            return await self._mock_search(category, top_k)
+            try:
+                url = "https://serpapi.com/search"
+                params = {
+                    "engine": "google_shopping",
+                    "q": category,
+                    "api_key": self.serpapi_key,
+                    "num": top_k
+                }
+                
+                async with _get_session().get(url, params=params, timeout=SERPAPI_TIMEOUT) as response:
+                    response.raise_for_status()
+                    data = orjson.loads(await response.read())
+                
+                products = []
+                shopping_results = data.get("shopping_results", [])
+                
+                for result in shopping_results[:top_k]:
+                    product = Product(
+                        product_id=result.get("product_id", ""),
+                        title=result.get("title", "Unknown Product"),
+                        brand=result.get("source", ""),
+                        price=self._extract_price(result.get("price", "")),
+                        currency="USD",
+                        image_url=result.get("thumbnail", ""),
+                        buy_url=result.get("link", ""),
+                        category=category,
+                        confidence=0.85  # High confidence for real search results
+                    )
+                    products.append(product)
+                
+                _serp_cache[key] = products
+                return list(products)
+                
+            except Exception as e:
+                print(f"SerpAPI search failed: {e}")
+                return await self._mock_search(category, top_k)
     
     async def _mock_search(self, category: str, top_k: int) -> List[Product]:
         """Fallback mock search when no API key is available."""
-        
-        # Mock product data based on category
-        mock_products = {
-            "sneakers": [
-                {
-                    "title": f"Classic {category.title()}",
-                    "brand": "Nike",
-                    "price": 89.99,
-                    "image_url": "https://images.unsplash.com/photo-1542291026-7eec264c27ff",
-                    "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
-                },
-                {
-                    "title": f"Premium {category.title()}",
-                    "brand": "Adidas",
-                    "price": 110.00,
-                    "image_url": "https://images.unsplash.com/photo-1549298916-b41d501d3772",
-                    "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
-                }
-            ],
-            "hoodie": [
-                {
-                    "title": f"Comfortable {category.title()}",
-                    "brand": "Champion",
-                    "price": 65.00,
-                    "image_url": "https://images.unsplash.com/photo-1556821840-3a63f95609a7",
-                    "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
-                }
-            ],
-            "jeans": [
-                {
-                    "title": f"Denim {category.title()}",
-                    "brand": "Levi's",
-                    "price": 79.99,
-                    "image_url": "https://images.unsplash.com/photo-1542272604-787c3835535d",
-                    "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
-                }
-            ]
-        }
-        
-        # Get mock products for this category or use generic
-        category_products = mock_products.get(category, [
-            {
-                "title": f"{category.title()}",
-                "brand": "Generic Brand",
-                "price": 50.00,
-                "image_url": "https://images.unsplash.com/photo-1523275335684-37898b6baf30",
-                "buy_url": f"https://www.google.com/search?q={category}+buy+online&tbm=shop"
-            }
-        ])
-        
-        products = []
-        for i, mock_data in enumerate(category_products[:top_k]):
-            product = Product(
-                product_id=f"mock-{category}-{i}",
-                title=mock_data["title"],
-                brand=mock_data["brand"],
-                price=mock_data["price"],
-                currency="USD",
-                image_url=mock_data["image_url"],
-                buy_url=mock_data["buy_url"],
-                category=category,
-                confidence=0.70  # Lower confidence for mock data
-            )
-            products.append(product)
-        
-        return products
+        return list(_mock_products(category, top_k))
     
     def _extract_price(self, price_str: str) -> float:
         """Extract numeric price from string like '$89.99'."""
         try:
-            # Remove currency symbols and convert to float
-            price_clean = price_str.replace("$", "").replace(",", "").strip()
-            return float(price_clean)
-        except:
+            # Remove currency symbols and separators in one pass
+            return float(_PRICE_RE.sub('', price_str) or 0.0)
+        except (TypeError, ValueError):
             return 0.0
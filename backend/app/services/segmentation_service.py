@@ -3,11 +3,111 @@ import numpy as np
 from PIL import Image
 import os
 import cv2
-from typing import Dict, Tuple, Optional
+from typing import Dict, List, Tuple
 import hashlib
+import logging
+import tempfile
+from functools import lru_cache
 
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Comprehensive product categories for all types of objects
+CATEGORIES = [
+    # Electronics & Devices
+    "laptop", "computer", "desktop computer", "monitor", "screen",
+    "smartphone", "phone", "tablet", "iPad",
+    "keyboard", "mouse", "webcam", "camera",
+    "headphones", "earbuds", "speakers",
+    "microphone", "mic", "studio microphone",
+    "charger", "cable", "USB cable",
+    
+    # Office & Studio Equipment
+    "desk", "office desk", "table",
+    "chair", "office chair", "gaming chair",
+    "lamp", "desk lamp", "ring light", "LED light",
+    "tripod", "camera tripod", "phone stand",
+    "notebook", "journal", "planner",
+    "pen", "pencil", "marker",
+    "book", "textbook",
+    
+    # Fashion & Apparel
+    "shoes", "sneakers", "boots", "sandals", "slippers",
+    "shirt", "t-shirt", "hoodie", "jacket", "coat", "sweater",
+    "pants", "jeans", "shorts", "skirt", "dress",
+    "hat", "cap", "beanie",
+    "bag", "backpack", "purse", "handbag", "briefcase",
+    "watch", "smartwatch", "fitness tracker",
+    "sunglasses", "glasses", "eyeglasses",
+    "jewelry", "necklace", "bracelet", "ring",
+    "belt", "tie", "scarf",
+    
+    # Home & Lifestyle
+    "water bottle", "coffee mug", "cup", "thermos",
+    "plant", "potted plant", "succulent",
+    "clock", "wall clock",
+    "picture frame", "poster", "artwork",
+    "pillow", "cushion",
+    "blanket", "throw blanket",
+    
+    # Gaming & Entertainment
+    "game controller", "gaming mouse", "gaming keyboard",
+    "VR headset", "console",
+    
+    # Fitness & Sports
+    "dumbbell", "yoga mat", "resistance band",
+    "water bottle", "gym bag",
+    
+    # Other Common Items
+    "bottle", "can", "container",
+    "box", "package",
+    "remote control",
+    "power bank",
+    "wallet", "purse"
+]
+
+# Persistent torch.compile (inductor) cache
+COMPILE_CACHE_DIR = os.path.expanduser("~/.cache/visor/compiled")
+
+# FP16 .npy (under MODEL_CACHE_DIR) of the fixed category text features, per model + prompt set
+CATEGORY_FEATURES_FILE = "clip_text_{key}.fp16.npy"
+
+# Crops per CLIP image forward
+CLIP_BATCH_SIZE = 16
+
+# Map YOLO classes to relevant CLIP categories
+YOLO_TO_CATEGORIES = {
+    'laptop': ['laptop', 'computer', 'MacBook', 'notebook computer', 'gaming laptop'],
+    'cell phone': ['smartphone', 'phone', 'iPhone', 'Android phone', 'mobile phone'],
+    'keyboard': ['keyboard', 'mechanical keyboard', 'gaming keyboard', 'wireless keyboard'],
+    'mouse': ['mouse', 'gaming mouse', 'wireless mouse', 'computer mouse'],
+    'tv': ['TV', 'television', 'monitor', 'screen', 'display'],
+    'remote': ['remote control', 'TV remote'],
+    'book': ['book', 'textbook', 'notebook', 'journal', 'magazine'],
+    'clock': ['clock', 'wall clock', 'desk clock', 'alarm clock'],
+    'vase': ['vase', 'flower vase', 'ceramic vase'],
+    'potted plant': ['potted plant', 'plant', 'succulent', 'indoor plant', 'houseplant'],
+    'chair': ['chair', 'office chair', 'gaming chair', 'desk chair', 'armchair'],
+    'couch': ['couch', 'sofa', 'loveseat', 'sectional'],
+    'bottle': ['water bottle', 'bottle', 'thermos', 'sports bottle', 'reusable bottle'],
+    'cup': ['cup', 'coffee mug', 'mug', 'tea cup', 'travel mug'],
+    'backpack': ['backpack', 'bag', 'school bag', 'hiking backpack', 'laptop bag'],
+    'handbag': ['handbag', 'purse', 'tote bag', 'shoulder bag'],
+    'tie': ['tie', 'necktie', 'bow tie'],
+    'umbrella': ['umbrella', 'rain umbrella', 'compact umbrella'],
+    'suitcase': ['suitcase', 'luggage', 'travel bag', 'carry-on'],
+}
+
+def _average_hash(image) -> bytes:
+    """64-bit perceptual (average) hash: 8x8 grayscale thresholded at its mean."""
+    if isinstance(image, Image.Image):
+        image = image.convert("RGB")
+    pixels = np.asarray(image)
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+    return np.packbits(small > small.mean()).tobytes()
+
 class SegmentationService:
     def __init__(self):
         self.device = self._get_device()
@@ -15,6 +115,16 @@ class SegmentationService:
         self.predictor = None
         self.clip_model = None
         self.clip_processor = None
+        self._text_features_cache: Dict[str, torch.Tensor] = {}
+        self._yolo_text_cache: Dict[str, Tuple[List[str], torch.Tensor]] = {}
+        # Each novel YOLO label gets its fallback prompts encoded once
+        self._fallback_text_features = lru_cache(maxsize=256)(self._encode_fallback)
+        self._prepared_image = None  # frame currently encoded in the SAM predictor
+        # video_id -> {(track_id, crop hash): CLIP image features}, for one job
+        self._track_embeddings: Dict[str, Dict[Tuple[int, bytes], torch.Tensor]] = {}
+        self._staging = None  # pinned host buffer for CLIP pixels (CUDA)
+        self._clip_compiled = False
+        self._category_text_features = None
         self.crops_dir = os.path.join(settings.STORAGE_PATH, "crops")
         os.makedirs(self.crops_dir, exist_ok=True)
         self._load_clip()
@@ -27,6 +137,33 @@ class SegmentationService:
         else:
             return torch.device("cpu")
     
+    def _autocast(self):
+        """FP16 autocast for CLIP and SAM on CUDA; a no-op elsewhere (MPS/CPU stay FP32)."""
+        return torch.autocast(
+            device_type=self.device.type,
+            dtype=torch.float16,
+            enabled=(self.device.type == "cuda")
+        )
+    
+    def _compile(self, module, name: str, example_input: torch.Tensor):
+        """
+        torch.compile a module, falling back to eager if compilation isn't available.
+        Compilation happens on the first forward, so it is run on example_input
+        here; errors then fall back to eager instead of failing every real call.
+        Shapes are static (callers feed example_input's shape), so other shapes
+        would recompile rather than hit the captured CUDA graph.
+        Inductor artifacts go to COMPILE_CACHE_DIR so restarts skip most of the work.
+        """
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+        try:
+            compiled = torch.compile(module, mode="reduce-overhead", fullgraph=False, dynamic=False)
+            with torch.no_grad(), self._autocast():
+                compiled(example_input)
+            return compiled
+        except Exception as e:
+            logger.warning("torch.compile unavailable, using eager %s: %s", name, e)
+            return module
+    
     def _load_clip(self):
         """Load CLIP model for object classification."""
         if self.clip_model is not None:
@@ -40,16 +177,56 @@ class SegmentationService:
             # - openai/clip-vit-base-patch32 (base, faster)
             # - openai/clip-vit-large-patch14 (large, more accurate)
             model_name = "openai/clip-vit-large-patch14"
+            self.clip_model_name = model_name
             
             print(f"Loading CLIP model ({model_name})...")
             self.clip_model = CLIPModel.from_pretrained(model_name)
             self.clip_processor = CLIPProcessor.from_pretrained(model_name)
             self.clip_model.to(self.device)
+            
+            # CLIPImageProcessor settings for the tensor preprocessing path
+            image_processor = self.clip_processor.image_processor
+            self.clip_resize = image_processor.size["shortest_edge"]
+            self.clip_crop = (image_processor.crop_size["height"], image_processor.crop_size["width"])
+            self.clip_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, 3, 1, 1)
+            self.clip_std = torch.tensor(image_processor.image_std, device=self.device).view(1, 3, 1, 1)
+            
             print(f"Loaded CLIP on {self.device}")
         except Exception as e:
             print(f"Error loading CLIP: {e}")
             raise
     
+    def _load_categories(self):
+        """
+        Category prompts are fixed, so they are encoded (or read from disk) once,
+        on the first classification rather than at startup.
+        """
+        if self._category_text_features is not None:
+            return
+        
+        all_categories = CATEGORIES + [cat for cats in YOLO_TO_CATEGORIES.values() for cat in cats]
+        self._load_category_features(list(dict.fromkeys(all_categories)))
+        self._yolo_text_cache = {
+            yolo_class: (categories, self._get_text_features(categories))
+            for yolo_class, categories in YOLO_TO_CATEGORIES.items()
+        }
+        self._category_text_features = self._get_text_features(CATEGORIES)
+    
+    def _compile_clip(self):
+        """
+        Compile the CLIP vision tower on CUDA the first time crops are batched
+        through it, so processes that never classify don't pay for it.
+        """
+        if self._clip_compiled:
+            return
+        self._clip_compiled = True
+        if self.device.type == "cuda":
+            self.clip_model.vision_model = self._compile(
+                self.clip_model.vision_model,
+                "CLIP vision tower",
+                torch.zeros(CLIP_BATCH_SIZE, 3, *self.clip_crop, device=self.device)
+            )
+    
     def _load_model(self):
         if self.model is not None:
             return
@@ -71,6 +248,15 @@ class SegmentationService:
             model_cfg = "sam2_hiera_b+.yaml"
             
             self.model = build_sam2(model_cfg, model_path, device=self.device)
+            
+            if self.device.type == "cuda":
+                # set_image always feeds the encoder 1024x1024, so shapes are static
+                self.model.image_encoder = self._compile(
+                    self.model.image_encoder,
+                    "SAM 2 image encoder",
+                    torch.zeros(1, 3, self.model.image_size, self.model.image_size, device=self.device)
+                )
+            
             self.predictor = SAM2ImagePredictor(self.model)
             
             print(f"Loaded SAM 2 on {self.device}")
@@ -79,171 +265,241 @@ class SegmentationService:
             print("Install with: pip install git+https://github.com/facebookresearch/segment-anything-2.git")
             raise
     
-    def _classify_object(self, crop_image):
-        """Classify the segmented object using CLIP."""
-        from PIL import Image
-        import torch
+    def preload(self):
+        """
+        Load SAM 2 and, on CUDA, run one dummy box prompt so compilation and
+        cuDNN autotuning happen before the first real frame.
+        """
+        self._load_model()
+        if self.device.type != "cuda":
+            return
         
-        # Comprehensive product categories for all types of objects
+        dummy_image = np.zeros((1024, 1024, 3), dtype=np.uint8)
+        self.prepare_frame(dummy_image)
+        self.predict_box({'x': 0, 'y': 0, 'width': 512, 'height': 512})
+        self._prepared_image = None
+        torch.cuda.synchronize(self.device)
+    
+    def _classify_object(self, crop_image, video_id: str = None, track_id: int = None):
+        """Classify the segmented object using CLIP."""
+        track_ids = None if track_id is None else [track_id]
+        return self.classify_batch([crop_image], video_id, track_ids)[0]
+    
+    def classify_batch(
+        self,
+        crop_images: List,
+        video_id: str = None,
+        track_ids: List[int] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Classify several crops (e.g. all new tracks in a frame) with batched CLIP
+        forwards. With track_ids, a track whose crop looks unchanged reuses its
+        features until release_tracks(video_id).
+        """
+        self._compile_clip()
+        self._load_categories()
+        results = []
+        for start in range(0, len(crop_images), CLIP_BATCH_SIZE):
+            batch_track_ids = None if track_ids is None else track_ids[start:start + CLIP_BATCH_SIZE]
+            image_features = self._encode_images(crop_images[start:start + CLIP_BATCH_SIZE], video_id, batch_track_ids)
+            results.extend(self._match_categories(image_features, CATEGORIES, self._category_text_features))
+        return results
+    
+    def _classify_object_with_context(self, crop_image, yolo_class: str):
+        """
+        Classify object using CLIP with YOLO class as context.
+        Narrows down categories based on YOLO detection for better accuracy.
+        """
+        # Stacked text features per YOLO class are built once, so routing is a lookup
+        categories, text_features = self._yolo_text_features(yolo_class)
+        return self._classify_against(crop_image, categories, text_features)
+    
+    def _yolo_text_features(self, yolo_class: str) -> Tuple[List[str], torch.Tensor]:
+        """(categories, stacked text features) for a YOLO class; unmapped classes are cached on first use."""
+        self._load_categories()
+        if yolo_class in self._yolo_text_cache:
+            return self._yolo_text_cache[yolo_class]
+        return self._fallback_text_features(yolo_class)
+    
+    def _encode_fallback(self, yolo_class: str) -> Tuple[List[str], torch.Tensor]:
+        # Fallback: use YOLO class name and some generic variations
         categories = [
-            # Electronics & Devices
-            "laptop", "computer", "desktop computer", "monitor", "screen",
-            "smartphone", "phone", "tablet", "iPad",
-            "keyboard", "mouse", "webcam", "camera",
-            "headphones", "earbuds", "speakers",
-            "microphone", "mic", "studio microphone",
-            "charger", "cable", "USB cable",
-            
-            # Office & Studio Equipment
-            "desk", "office desk", "table",
-            "chair", "office chair", "gaming chair",
-            "lamp", "desk lamp", "ring light", "LED light",
-            "tripod", "camera tripod", "phone stand",
-            "notebook", "journal", "planner",
-            "pen", "pencil", "marker",
-            "book", "textbook",
-            
-            # Fashion & Apparel
-            "shoes", "sneakers", "boots", "sandals", "slippers",
-            "shirt", "t-shirt", "hoodie", "jacket", "coat", "sweater",
-            "pants", "jeans", "shorts", "skirt", "dress",
-            "hat", "cap", "beanie",
-            "bag", "backpack", "purse", "handbag", "briefcase",
-            "watch", "smartwatch", "fitness tracker",
-            "sunglasses", "glasses", "eyeglasses",
-            "jewelry", "necklace", "bracelet", "ring",
-            "belt", "tie", "scarf",
-            
-            # Home & Lifestyle
-            "water bottle", "coffee mug", "cup", "thermos",
-            "plant", "potted plant", "succulent",
-            "clock", "wall clock",
-            "picture frame", "poster", "artwork",
-            "pillow", "cushion",
-            "blanket", "throw blanket",
-            
-            # Gaming & Entertainment
-            "game controller", "gaming mouse", "gaming keyboard",
-            "VR headset", "console",
-            
-            # Fitness & Sports
-            "dumbbell", "yoga mat", "resistance band",
-            "water bottle", "gym bag",
-            
-            # Other Common Items
-            "bottle", "can", "container",
-            "box", "package",
-            "remote control",
-            "power bank",
-            "wallet", "purse"
+            yolo_class,
+            f"{yolo_class} product",
+            f"modern {yolo_class}",
+            f"professional {yolo_class}",
+            f"premium {yolo_class}"
         ]
-        
-        # Prepare text prompts
-        text_inputs = self.clip_processor(
-            text=[f"a photo of {cat}" for cat in categories],
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        # Prepare image
-        image_inputs = self.clip_processor(
-            images=crop_image,
-            return_tensors="pt"
-        ).to(self.device)
-        
-        # Get predictions
-        with torch.no_grad():
-            image_features = self.clip_model.get_image_features(**image_inputs)
-            text_features = self.clip_model.get_text_features(**text_inputs)
+        return categories, self._get_text_features(categories)
+    
+    def _get_text_features(self, categories: List[str]) -> torch.Tensor:
+        """Normalized "a photo of ..." text features, encoding only categories not yet cached."""
+        missing = [cat for cat in dict.fromkeys(categories) if cat not in self._text_features_cache]
+        if missing:
+            text_inputs = self.clip_processor(
+                text=[f"a photo of {cat}" for cat in missing],
+                return_tensors="pt",
+                padding=True
+            ).to(self.device)
             
-            # Normalize features
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+            with torch.inference_mode(), self._autocast():
+                text_features = self.clip_model.get_text_features(**text_inputs)
+            text_features = text_features.float()
             text_features = text_features / text_features.norm(dim=-1, keepdim=True)
             
-            # Calculate similarity
-            similarity = (image_features @ text_features.T).squeeze(0)
-            probs = similarity.softmax(dim=0)
-            
-            # Get top prediction
-            top_idx = probs.argmax().item()
-            confidence = probs[top_idx].item()
-            
-            return categories[top_idx], confidence
+            self._text_features_cache.update(zip(missing, text_features))
+        
+        return torch.stack([self._text_features_cache[cat] for cat in categories])
     
-    def _classify_object_with_context(self, crop_image, yolo_class: str):
+    def _load_category_features(self, categories: List[str]):
         """
-        Classify object using CLIP with YOLO class as context.
-        Narrows down categories based on YOLO detection for better accuracy.
+        Fill the text feature cache for the fixed categories from an FP16 .npy,
+        encoding and saving it only when the model or prompt set changes.
         """
-        import torch
-        
-        # Map YOLO classes to relevant CLIP categories
-        yolo_to_categories = {
-            'laptop': ['laptop', 'computer', 'MacBook', 'notebook computer', 'gaming laptop'],
-            'cell phone': ['smartphone', 'phone', 'iPhone', 'Android phone', 'mobile phone'],
-            'keyboard': ['keyboard', 'mechanical keyboard', 'gaming keyboard', 'wireless keyboard'],
-            'mouse': ['mouse', 'gaming mouse', 'wireless mouse', 'computer mouse'],
-            'tv': ['TV', 'television', 'monitor', 'screen', 'display'],
-            'remote': ['remote control', 'TV remote'],
-            'book': ['book', 'textbook', 'notebook', 'journal', 'magazine'],
-            'clock': ['clock', 'wall clock', 'desk clock', 'alarm clock'],
-            'vase': ['vase', 'flower vase', 'ceramic vase'],
-            'potted plant': ['potted plant', 'plant', 'succulent', 'indoor plant', 'houseplant'],
-            'chair': ['chair', 'office chair', 'gaming chair', 'desk chair', 'armchair'],
-            'couch': ['couch', 'sofa', 'loveseat', 'sectional'],
-            'bottle': ['water bottle', 'bottle', 'thermos', 'sports bottle', 'reusable bottle'],
-            'cup': ['cup', 'coffee mug', 'mug', 'tea cup', 'travel mug'],
-            'backpack': ['backpack', 'bag', 'school bag', 'hiking backpack', 'laptop bag'],
-            'handbag': ['handbag', 'purse', 'tote bag', 'shoulder bag'],
-            'tie': ['tie', 'necktie', 'bow tie'],
-            'umbrella': ['umbrella', 'rain umbrella', 'compact umbrella'],
-            'suitcase': ['suitcase', 'luggage', 'travel bag', 'carry-on'],
-        }
+        key = hashlib.sha1("\n".join([self.clip_model_name, *categories]).encode()).hexdigest()[:16]
+        os.makedirs(settings.MODEL_CACHE_DIR, exist_ok=True)
+        path = os.path.join(settings.MODEL_CACHE_DIR, CATEGORY_FEATURES_FILE.format(key=key))
+        
+        if os.path.exists(path):
+            features = np.load(path, mmap_mode="r")
+            features = torch.tensor(features, dtype=torch.float32, device=self.device)
+            self._text_features_cache.update(zip(categories, features))
+            return
         
-        # Get relevant categories for this YOLO class, or use all if not mapped
-        if yolo_class in yolo_to_categories:
-            categories = yolo_to_categories[yolo_class]
-        else:
-            # Fallback: use YOLO class name and some generic variations
-            categories = [
-                yolo_class,
-                f"{yolo_class} product",
-                f"modern {yolo_class}",
-                f"professional {yolo_class}",
-                f"premium {yolo_class}"
-            ]
-        
-        # Prepare text prompts
-        text_inputs = self.clip_processor(
-            text=[f"a photo of {cat}" for cat in categories],
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        # Prepare image
-        image_inputs = self.clip_processor(
-            images=crop_image,
-            return_tensors="pt"
-        ).to(self.device)
-        
-        # Get predictions
-        with torch.no_grad():
-            image_features = self.clip_model.get_image_features(**image_inputs)
-            text_features = self.clip_model.get_text_features(**text_inputs)
-            
-            # Normalize features
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        features = self._get_text_features(categories)
+        # Workers start together; each writes its own temp file and the
+        # atomic rename means readers only ever see a complete file
+        with tempfile.NamedTemporaryFile(dir=settings.MODEL_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            np.save(f, features.cpu().numpy().astype(np.float16))
+        try:
+            os.replace(f.name, path)
+        except OSError as e:
+            # Another process got there first (same contents) or the dir is
+            # read-only; the features are already in memory either way
+            logger.warning("Could not save CLIP category features: %s", e)
+            os.unlink(f.name)
+    
+    def _classify_against(self, crop_image, categories: List[str], text_features: torch.Tensor):
+        """Pick the category whose cached text features best match the crop."""
+        image_features = self._encode_images([crop_image])
+        return self._match_categories(image_features, categories, text_features)[0]
+    
+    def _encode_images(self, crop_images: List, video_id: str = None, track_ids: List[int] = None) -> torch.Tensor:
+        """
+        Normalized CLIP image features for a batch of crops. A tracked crop
+        whose perceptual hash matches an earlier crop of the same track in
+        this job skips the forward; the hash alone never matches across tracks.
+        """
+        if video_id is None or track_ids is None:
+            return self._forward_images(crop_images)
+        
+        cache = self._track_embeddings.setdefault(video_id, {})
+        keys = [(track_id, _average_hash(crop)) for track_id, crop in zip(track_ids, crop_images)]
+        
+        missing = [i for i, key in enumerate(keys) if key not in cache]
+        if missing:
+            image_features = self._forward_images([crop_images[i] for i in missing])
+            cache.update(zip([keys[i] for i in missing], image_features))
+        
+        return torch.stack([cache[key] for key in keys])
+    
+    def release_tracks(self, video_id: str):
+        """Drop the per-track features cached for a finished job."""
+        self._track_embeddings.pop(video_id, None)
+    
+    def _forward_images(self, crop_images: List) -> torch.Tensor:
+        """Normalized CLIP image features for a batch of crops in one forward."""
+        # Prepare images: uint8 NHWC goes to the device, the rest runs there
+        pixel_values = self._to_device(self._crop_pixels(crop_images))
+        pixel_values = pixel_values.permute(0, 3, 1, 2).float().div_(255.0)
+        pixel_values = (pixel_values - self.clip_mean) / self.clip_std
+        
+        # The compiled tower only has a graph for full batches, so pad partial ones
+        num_images = pixel_values.shape[0]
+        if hasattr(self.clip_model.vision_model, "_orig_mod") and num_images < CLIP_BATCH_SIZE:
+            padding = pixel_values.new_zeros((CLIP_BATCH_SIZE - num_images, *pixel_values.shape[1:]))
+            pixel_values = torch.cat([pixel_values, padding])
+        
+        with torch.inference_mode(), self._autocast():
+            image_features = self.clip_model.get_image_features(pixel_values=pixel_values)
+        
+        # Normalize features in FP32
+        image_features = image_features[:num_images].float()
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+    
+    def _crop_pixels(self, crop_images: List) -> np.ndarray:
+        """
+        Resize (shortest side, bicubic) and center crop like CLIPImageProcessor,
+        but straight on the RGB arrays; returns a uint8 [B,H,W,3] batch.
+        """
+        crop_h, crop_w = self.clip_crop
+        batch = np.empty((len(crop_images), crop_h, crop_w, 3), dtype=np.uint8)
+        for i, crop in enumerate(crop_images):
+            if isinstance(crop, Image.Image):
+                crop = np.asarray(crop.convert("RGB"))
             
-            # Calculate similarity
-            similarity = (image_features @ text_features.T).squeeze(0)
-            probs = similarity.softmax(dim=0)
+            h, w = crop.shape[:2]
+            scale = self.clip_resize / min(h, w)
+            new_h, new_w = max(crop_h, round(h * scale)), max(crop_w, round(w * scale))
+            resized = cv2.resize(crop, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
             
-            # Get top prediction
-            top_idx = probs.argmax().item()
-            confidence = probs[top_idx].item()
+            top = (new_h - crop_h) // 2
+            left = (new_w - crop_w) // 2
+            batch[i] = resized[top:top + crop_h, left:left + crop_w]
+        
+        return batch
+    
+    def _to_device(self, pixels: np.ndarray) -> torch.Tensor:
+        """
+        Move a uint8 pixel batch to the device. On CUDA it is staged through a
+        reused pinned buffer and copied on a side stream.
+        """
+        pixels = torch.from_numpy(pixels)
+        if self.device.type != "cuda":
+            return pixels.to(self.device)
+        
+        batch_size = pixels.shape[0]
+        if self._staging is None or self._staging.shape[1:] != pixels.shape[1:]:
+            self._staging = torch.empty(
+                (CLIP_BATCH_SIZE, *pixels.shape[1:]),
+                dtype=torch.uint8,
+                pin_memory=True
+            )
+            self._copy_stream = torch.cuda.Stream(self.device)
+            self._staging_free = torch.cuda.Event()
+            self._staging_free.record(self._copy_stream)
+        
+        # Don't overwrite the buffer while the previous copy may still read it
+        self._staging_free.synchronize()
+        staging = self._staging[:batch_size]
+        staging.copy_(pixels)
+        
+        with torch.cuda.stream(self._copy_stream):
+            device_values = staging.to(self.device, non_blocking=True)
+            self._staging_free.record(self._copy_stream)
+        
+        # Compute on the default stream waits for the copy only
+        compute_stream = torch.cuda.current_stream(self.device)
+        compute_stream.wait_stream(self._copy_stream)
+        device_values.record_stream(compute_stream)
+        return device_values
+    
+    def _match_categories(
+        self,
+        image_features: torch.Tensor,
+        categories: List[str],
+        text_features: torch.Tensor
+    ) -> List[Tuple[str, float]]:
+        """Top category and its cosine similarity for each row of image_features."""
+        with torch.inference_mode():
+            # Calculate similarity; softmax doesn't change the argmax, so skip it
+            similarity = image_features @ text_features.T
+            top = similarity.max(dim=-1)
             
-            return categories[top_idx], confidence
+            # One device sync for the whole batch
+            top_rows = torch.stack([top.indices.float(), top.values.float()], dim=1).tolist()
+        
+        return [(categories[int(top_idx)], confidence) for top_idx, confidence in top_rows]
     
     async def segment_with_box(
         self,
@@ -253,31 +509,31 @@ class SegmentationService:
         timestamp_ms: int
     ) -> Dict:
         """Segment object using bounding box prompt for precise segmentation."""
-        self._load_model()
-        
         image = cv2.imread(frame_path)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        self.predictor.set_image(image_rgb)
-        
-        # Convert bbox to SAM format [x1, y1, x2, y2]
-        input_box = np.array([
-            bbox['x'],
-            bbox['y'],
-            bbox['x'] + bbox['width'],
-            bbox['y'] + bbox['height']
-        ])
+        image_rgb = np.ascontiguousarray(image[..., ::-1])
         
-        # Use box prompt for more accurate segmentation
-        masks, scores, logits = self.predictor.predict(
-            point_coords=None,
-            point_labels=None,
-            box=input_box[None, :],
-            multimask_output=False
-        )
-        
-        mask = masks[0]
-        confidence = float(scores[0])
+        return await self.segment_with_box_array(image_rgb, bbox, video_id, timestamp_ms)
+    
+    async def segment_with_box_array(
+        self,
+        image_rgb: np.ndarray,
+        bbox: Dict[str, float],
+        video_id: str,
+        timestamp_ms: int
+    ) -> Dict:
+        """Same as segment_with_box, for a frame that is already decoded (RGB)."""
+        return self.segment_box_array(image_rgb, bbox, video_id, timestamp_ms)
+    
+    def segment_box_array(
+        self,
+        image_rgb: np.ndarray,
+        bbox: Dict[str, float],
+        video_id: str,
+        timestamp_ms: int
+    ) -> Dict:
+        """Blocking version of segment_with_box_array, for worker threads."""
+        self.prepare_frame(image_rgb)
+        mask, confidence = self.predict_box(bbox)
         
         mask_filename = f"{video_id}_{timestamp_ms}_mask.png"
         mask_path = os.path.join(self.crops_dir, mask_filename)
@@ -289,6 +545,63 @@ class SegmentationService:
             "confidence": confidence
         }
     
+    def segment_boxes_array(
+        self,
+        image_rgb: np.ndarray,
+        bboxes: List[Dict[str, float]],
+        mask_paths: List[str]
+    ) -> List[float]:
+        """
+        Segment several boxes on one RGB frame with a single batched mask
+        decoder call; writes each mask to its path and returns the scores.
+        """
+        self.prepare_frame(image_rgb)
+        masks, scores = self.predict_boxes(bboxes)
+        
+        for mask, mask_path in zip(masks, mask_paths):
+            self._save_mask(mask, mask_path)
+        
+        return scores.tolist()
+    
+    def prepare_frame(self, image_rgb: np.ndarray):
+        """
+        Run the SAM 2 image encoder for a frame. Repeated calls with the same
+        array are skipped, so several box prompts on one frame encode it once.
+        """
+        self._load_model()
+        
+        if image_rgb is self._prepared_image:
+            return
+        
+        with self._autocast():
+            self.predictor.set_image(image_rgb)
+        self._prepared_image = image_rgb
+    
+    def predict_box(self, bbox: Dict[str, float]) -> Tuple[np.ndarray, float]:
+        """Box-prompt mask and score for the frame set by prepare_frame."""
+        masks, scores = self.predict_boxes([bbox])
+        return masks[0], float(scores[0])
+    
+    def predict_boxes(self, bboxes: List[Dict[str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Masks [N,H,W] and scores [N] for N box prompts, in one decoder call."""
+        # Convert bboxes to SAM format [x1, y1, x2, y2]
+        input_boxes = np.array([
+            [bbox['x'], bbox['y'], bbox['x'] + bbox['width'], bbox['y'] + bbox['height']]
+            for bbox in bboxes
+        ])
+        
+        # Use box prompts for more accurate segmentation
+        with self._autocast():
+            masks, scores, logits = self.predictor.predict(
+                point_coords=None,
+                point_labels=None,
+                box=input_boxes,
+                multimask_output=False
+            )
+        
+        # One box comes back as [1,H,W], several as [N,1,H,W]
+        return masks.reshape(len(bboxes), *masks.shape[-2:]), scores.reshape(len(bboxes))
+    
     async def segment(
         self,
         frame_path: str,
@@ -300,18 +613,18 @@ class SegmentationService:
         self._load_model()
         
         image = cv2.imread(frame_path)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        self.predictor.set_image(image_rgb)
+        image_rgb = np.ascontiguousarray(image[..., ::-1])
         
         point_coords = np.array([[click_x, click_y]])
         point_labels = np.array([1])
         
-        masks, scores, logits = self.predictor.predict(
-            point_coords=point_coords,
-            point_labels=point_labels,
-            multimask_output=True
-        )
+        self.prepare_frame(image_rgb)
+        with self._autocast():
+            masks, scores, logits = self.predictor.predict(
+                point_coords=point_coords,
+                point_labels=point_labels,
+                multimask_output=True
+            )
         
         best_idx = np.argmax(scores)
         mask = masks[best_idx]
@@ -326,14 +639,17 @@ class SegmentationService:
         crop_filename = f"{video_id}_{timestamp_ms}_crop.png"
         crop_path = os.path.join(self.crops_dir, crop_filename)
         crop_image = self._create_crop(image_rgb, mask, bbox)
-        cv2.imwrite(crop_path, cv2.cvtColor(crop_image, cv2.COLOR_RGB2BGR))
+        cv2.imwrite(crop_path, crop_image[..., ::-1])
         
-        embedding = self._generate_embedding(crop_image)
+        # One CLIP image forward feeds both the embedding and the classification
+        image_features = self._encode_images([crop_image])
+        embedding = self._generate_embedding(image_features)
         
         # Classify the object
-        from PIL import Image
-        crop_pil = Image.fromarray(crop_image)
-        object_category, classification_confidence = self._classify_object(crop_pil)
+        self._load_categories()
+        object_category, classification_confidence = self._match_categories(
+            image_features, CATEGORIES, self._category_text_features
+        )[0]
         
         return {
             "bbox": bbox,
@@ -346,24 +662,24 @@ class SegmentationService:
         }
     
     def _mask_to_bbox(self, mask: np.ndarray) -> Dict[str, float]:
-        y_indices, x_indices = np.where(mask)
+        # Bounding rect of the non-zero pixels, without materializing their coordinates
+        x, y, w, h = cv2.boundingRect(mask.astype(np.uint8))
         
-        if len(x_indices) == 0 or len(y_indices) == 0:
+        if w == 0 or h == 0:
             return {"x": 0, "y": 0, "width": 0, "height": 0}
         
-        x_min, x_max = float(x_indices.min()), float(x_indices.max())
-        y_min, y_max = float(y_indices.min()), float(y_indices.max())
-        
+        # Width/height stay max - min (inclusive pixel extents), as before
         return {
-            "x": x_min,
-            "y": y_min,
-            "width": x_max - x_min,
-            "height": y_max - y_min
+            "x": float(x),
+            "y": float(y),
+            "width": float(w - 1),
+            "height": float(h - 1)
         }
     
     def _save_mask(self, mask: np.ndarray, path: str):
         mask_img = (mask * 255).astype(np.uint8)
-        cv2.imwrite(path, mask_img)
+        # Binary masks barely shrink at higher levels; level 1 is much faster to write
+        cv2.imwrite(path, mask_img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
     
     def _create_crop(
         self,
@@ -380,47 +696,37 @@ class SegmentationService:
         x2 = min(image.shape[1], x + w + padding)
         y2 = min(image.shape[0], y + h + padding)
         
-        crop = image[y1:y2, x1:x2].copy()
-        crop_mask = mask[y1:y2, x1:x2]
-        
-        crop_rgba = np.zeros((crop.shape[0], crop.shape[1], 4), dtype=np.uint8)
-        crop_rgba[:, :, :3] = crop
-        crop_rgba[:, :, 3] = (crop_mask * 255).astype(np.uint8)
+        # The alpha channel (mask) was dropped from the returned crop, so
+        # letterbox the RGB pixels directly
+        crop = image[y1:y2, x1:x2]
         
         target_size = 336
-        scale = min(target_size / crop_rgba.shape[1], target_size / crop_rgba.shape[0])
-        new_w = int(crop_rgba.shape[1] * scale)
-        new_h = int(crop_rgba.shape[0] * scale)
+        scale = min(target_size / crop.shape[1], target_size / crop.shape[0])
+        new_w = int(crop.shape[1] * scale)
+        new_h = int(crop.shape[0] * scale)
         
-        resized = cv2.resize(crop_rgba, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+        # CLIP resamples again anyway; area for downscaling, linear for upscaling
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        resized = cv2.resize(crop, (new_w, new_h), interpolation=interpolation)
         
-        final = np.ones((target_size, target_size, 4), dtype=np.uint8) * 255
-        final[:, :, 3] = 0
+        final = np.full((target_size, target_size, 3), 255, dtype=np.uint8)
         
         y_offset = (target_size - new_h) // 2
         x_offset = (target_size - new_w) // 2
         final[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized
         
-        return final[:, :, :3]
+        return final
     
-    def _generate_embedding(self, crop: np.ndarray) -> Optional[list]:
-        try:
-            from transformers import CLIPProcessor, CLIPModel
-            
-            if not hasattr(self, 'clip_model'):
-                self.clip_model = CLIPModel.from_pretrained(settings.CLIP_MODEL)
-                self.clip_processor = CLIPProcessor.from_pretrained(settings.CLIP_MODEL)
-                self.clip_model.to(self.device)
-            
-            pil_image = Image.fromarray(crop)
-            inputs = self.clip_processor(images=pil_image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                image_features = self.clip_model.get_image_features(**inputs)
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            return image_features.cpu().numpy().flatten().tolist()
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return None
+    def embed_batch(self, crops: List[np.ndarray], video_id: str = None, track_ids: List[int] = None) -> List[list]:
+        """CLIP embeddings for several RGB crops with batched forwards (track reuse as in classify_batch)."""
+        self._compile_clip()
+        embeddings = []
+        for start in range(0, len(crops), CLIP_BATCH_SIZE):
+            batch_track_ids = None if track_ids is None else track_ids[start:start + CLIP_BATCH_SIZE]
+            image_features = self._encode_images(crops[start:start + CLIP_BATCH_SIZE], video_id, batch_track_ids)
+            embeddings.extend(image_features.cpu().tolist())
+        return embeddings
+    
+    def _generate_embedding(self, image_features: torch.Tensor) -> list:
+        """Embedding list for a single crop's normalized CLIP image features."""
+        return image_features[0].cpu().tolist()
@@ -0,0 +1,46 @@
+"""Video metadata via ffprobe, without loading any models."""
+
+import json
+import subprocess
+from typing import Dict
+
+def probe_metadata(video_path: str) -> Dict:
+    """Duration, size and frame rate of a video file or URL ({} on failure). Blocking."""
+    try:
+        cmd = [
+            'ffprobe',
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format',
+            '-show_streams',
+            video_path
+        ]
+        
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        data = json.loads(result.stdout)
+        
+        video_stream = next(
+            (s for s in data.get('streams', []) if s['codec_type'] == 'video'),
+            None
+        )
+        
+        if not video_stream:
+            return {}
+        
+        duration = float(data.get('format', {}).get('duration', 0))
+        width = int(video_stream.get('width', 0))
+        height = int(video_stream.get('height', 0))
+        
+        fps_str = video_stream.get('r_frame_rate', '0/1')
+        fps_parts = fps_str.split('/')
+        fps = float(fps_parts[0]) / float(fps_parts[1]) if len(fps_parts) == 2 else 0
+        
+        return {
+            'duration': duration,
+            'width': width,
+            'height': height,
+            'fps': fps
+        }
+    except Exception as e:
+        print(f"Error extracting metadata: {e}")
+        return {}
@@ -1,88 +1,194 @@
 import subprocess
 import json
+import orjson
+import asyncio
+import logging
+import queue
+import tempfile
+import threading
+import torch
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import os
-from typing import Dict, List, Optional
+from numba import njit
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 
+from app.services.frame_extractor import FrameExtractor
 from app.services.grounding_dino_service import GroundingDINOService
 from app.services.segmentation_service import SegmentationService
 from app.services.product_search import ProductSearchService
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Decoded frames buffered ahead of inference (enough for the next detection batch)
+FRAME_QUEUE_SIZE = 8
+
+# Sampled frames whose 64x64 gray thumbnail differs from the last detected
+# frame by less than this mean absolute difference (0-255) reuse its
+# detections, but detection still runs at least every MAX_REUSED_FRAMES + 1 samples
+SCENE_CHANGE_THRESHOLD = 4.0
+MAX_REUSED_FRAMES = 4
+
+def _read_exact(stream, size: int) -> Optional[bytearray]:
+    """Read exactly size bytes into a writable buffer, or None at EOF."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        count = stream.readinto(view[filled:])
+        if not count:
+            return None
+        filled += count
+    return buffer
+
+def _get_frame(frame_queue: queue.Queue, stop_event: threading.Event):
+    """
+    Next item from the reader, or None once the pipeline is stopping. The
+    reader skips its sentinel when stopped, so a plain get() could block
+    its executor thread forever (and asyncio.run waits for that thread).
+    """
+    while not stop_event.is_set():
+        try:
+            return frame_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+@njit(cache=True)
+def _greedy_match(iou: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Match each current detection (row) to the previous detection (column) with
+    the highest IoU above threshold, in detection order; -1 where none is left.
+    """
+    iou = iou.copy()
+    matches = np.full(iou.shape[0], -1, dtype=np.int64)
+    for i in range(iou.shape[0]):
+        best_idx = iou[i].argmax()
+        if iou[i, best_idx] > threshold:
+            matches[i] = best_idx
+            # A previous track can only be matched once
+            iou[:, best_idx] = 0.0
+    return matches
+
+class _TrackLog:
+    """
+    Per-frame detections kept as growable column arrays (structure of arrays)
+    rather than a dict per detection; tracks_by_frame() builds the output dicts
+    once, when the result is assembled.
+    """
+    
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.track_id = np.empty(capacity, dtype=np.int32)
+        self.label = np.empty(capacity, dtype=np.int16)
+        # Boxes and scores come off the GPU as FP32, so float32 is lossless
+        self.confidence = np.empty(capacity, dtype=np.float32)
+        self.bbox = np.empty((capacity, 4), dtype=np.float32)  # x, y, width, height
+        self.frames: List[Tuple[int, int, int]] = []  # (timestamp_ms, start, end) rows
+        self.labels: List[str] = []
+        self._label_index: Dict[str, int] = {}
+    
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self.track_id))
+        for name in ('track_id', 'label', 'confidence', 'bbox'):
+            column = getattr(self, name)
+            grown = np.empty((capacity, *column.shape[1:]), dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+    
+    def append(self, timestamp_ms: int, detections: List[Dict]):
+        start = self.size
+        end = start + len(detections)
+        if end > len(self.track_id):
+            self._grow(end)
+        
+        for row, detection in enumerate(detections, start):
+            label = detection['label']
+            label_idx = self._label_index.get(label)
+            if label_idx is None:
+                label_idx = self._label_index[label] = len(self.labels)
+                self.labels.append(label)
+            
+            bbox = detection['bbox']
+            self.track_id[row] = detection['track_id']
+            self.label[row] = label_idx
+            self.confidence[row] = detection['confidence']
+            self.bbox[row] = (bbox['x'], bbox['y'], bbox['width'], bbox['height'])
+        
+        self.size = end
+        self.frames.append((timestamp_ms, start, end))
+    
+    def tracks_by_frame(self) -> Dict[int, List[Dict]]:
+        """timestamp_ms -> [detections], in the tracking file's format."""
+        # One bulk conversion per column instead of per-element numpy scalars
+        track_ids = self.track_id[:self.size].tolist()
+        labels = self.label[:self.size].tolist()
+        confidences = self.confidence[:self.size].tolist()
+        bboxes = self.bbox[:self.size].tolist()
+        
+        return {
+            timestamp_ms: [
+                {
+                    'track_id': track_ids[i],
+                    'bbox': {'x': bboxes[i][0], 'y': bboxes[i][1], 'width': bboxes[i][2], 'height': bboxes[i][3]},
+                    'class': self.labels[labels[i]],
+                    'confidence': confidences[i]
+                }
+                for i in range(start, end)
+            ]
+            for timestamp_ms, start, end in self.frames
+        }
+
 class VideoProcessor:
     def __init__(self):
         self.grounding_dino = GroundingDINOService()
         self.segmentation_service = SegmentationService()
         self.product_search = ProductSearchService()
+        self.frame_extractor = FrameExtractor()
         self.tracked_objects = {}  # track_id -> detection history
+        self._streams = {}  # pipeline stage -> CUDA stream
+        # The models are shared by every job in the process, so each GPU stage
+        # has one worker thread here rather than per process_video call;
+        # concurrent jobs queue on it instead of driving a model from two threads
+        self._detect_executor = ThreadPoolExecutor(max_workers=1)
+        self._segment_executor = ThreadPoolExecutor(max_workers=1)
     
-    async def extract_metadata(self, video_path: str) -> Dict:
+    def preload(self):
+        """Load and warm up the models now rather than on the first frame."""
+        # On the stage threads, so a job that starts meanwhile waits its turn
+        self._detect_executor.submit(self.grounding_dino.preload).result()
         try:
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams',
-                video_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            data = json.loads(result.stdout)
-            
-            video_stream = next(
-                (s for s in data.get('streams', []) if s['codec_type'] == 'video'),
-                None
-            )
-            
-            if not video_stream:
-                return {}
-            
-            duration = float(data.get('format', {}).get('duration', 0))
-            width = int(video_stream.get('width', 0))
-            height = int(video_stream.get('height', 0))
-            
-            fps_str = video_stream.get('r_frame_rate', '0/1')
-            fps_parts = fps_str.split('/')
-            fps = float(fps_parts[0]) / float(fps_parts[1]) if len(fps_parts) == 2 else 0
-            
-            return {
-                'duration': duration,
-                'width': width,
-                'height': height,
-                'fps': fps
-            }
+            self._segment_executor.submit(self.segmentation_service.preload).result()
         except Exception as e:
-            print(f"Error extracting metadata: {e}")
-            return {}
+            # process_video falls back to OWL-ViT only when SAM is unavailable
+            logger.warning("SAM preload failed: %s", e)
     
-    def _calculate_iou(self, box1, box2):
-        """Calculate IoU between two boxes for tracking."""
-        x1_min, y1_min = box1['x'], box1['y']
-        x1_max, y1_max = x1_min + box1['width'], y1_min + box1['height']
-        
-        x2_min, y2_min = box2['x'], box2['y']
-        x2_max, y2_max = x2_min + box2['width'], y2_min + box2['height']
-        
-        # Calculate intersection
-        inter_x_min = max(x1_min, x2_min)
-        inter_y_min = max(y1_min, y2_min)
-        inter_x_max = min(x1_max, x2_max)
-        inter_y_max = min(y1_max, y2_max)
+    def _iou_matrix(self, boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+        """Pairwise IoU between (N,4) and (M,4) arrays of x, y, width, height."""
+        a_min = boxes_a[:, None, :2]
+        a_max = a_min + boxes_a[:, None, 2:]
+        b_min = boxes_b[None, :, :2]
+        b_max = b_min + boxes_b[None, :, 2:]
         
-        if inter_x_max < inter_x_min or inter_y_max < inter_y_min:
-            return 0.0
-        
-        inter_area = (inter_x_max - inter_x_min) * (inter_y_max - inter_y_min)
+        # Calculate intersection; disjoint boxes clip to zero
+        inter_wh = np.clip(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0.0, None)
+        inter_area = inter_wh[..., 0] * inter_wh[..., 1]
         
         # Calculate union
-        box1_area = box1['width'] * box1['height']
-        box2_area = box2['width'] * box2['height']
-        union_area = box1_area + box2_area - inter_area
+        area_a = boxes_a[:, 2] * boxes_a[:, 3]
+        area_b = boxes_b[:, 2] * boxes_b[:, 3]
+        union_area = area_a[:, None] + area_b[None, :] - inter_area
         
-        return inter_area / union_area if union_area > 0 else 0.0
+        return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+    
+    def _bbox_array(self, detections) -> np.ndarray:
+        return np.array(
+            [[d['bbox']['x'], d['bbox']['y'], d['bbox']['width'], d['bbox']['height']] for d in detections],
+            dtype=np.float64
+        ).reshape(-1, 4)
     
     def _assign_track_ids(self, current_detections, previous_detections, next_track_id):
         """Assign track IDs to detections using IoU matching."""
@@ -93,30 +199,17 @@ class VideoProcessor:
                 next_track_id += 1
             return current_detections, next_track_id
         
-        # Match current detections to previous ones
-        matched = set()
+        # All current/previous pairs at once; only same labels can match
+        iou = self._iou_matrix(self._bbox_array(current_detections), self._bbox_array(previous_detections))
+        curr_labels = np.array([d['label'] for d in current_detections])
+        prev_labels = np.array([d['label'] for d in previous_detections])
+        iou[curr_labels[:, None] != prev_labels[None, :]] = 0.0
         
-        for curr_det in current_detections:
-            best_iou = 0.3  # Minimum IoU threshold
-            best_match = None
-            
-            for prev_det in previous_detections:
-                if prev_det['track_id'] in matched:
-                    continue
-                
-                # Only match same labels
-                if curr_det['label'] != prev_det['label']:
-                    continue
-                
-                iou = self._calculate_iou(curr_det['bbox'], prev_det['bbox'])
-                
-                if iou > best_iou:
-                    best_iou = iou
-                    best_match = prev_det
-            
-            if best_match:
-                curr_det['track_id'] = best_match['track_id']
-                matched.add(best_match['track_id'])
+        # Match current detections to previous ones, greedily in detection order
+        matches = _greedy_match(iou, 0.3)  # Minimum IoU threshold
+        for curr_det, best_idx in zip(current_detections, matches.tolist()):
+            if best_idx >= 0:
+                curr_det['track_id'] = previous_detections[best_idx]['track_id']
             else:
                 # New object
                 curr_det['track_id'] = next_track_id
@@ -124,6 +217,180 @@ class VideoProcessor:
         
         return current_detections, next_track_id
     
+    def _read_frames(self, cap, video_path, sample_rate, frame_queue, stop_event):
+        """
+        Producer for process_video: push (frame_num, frame) for sampled frames,
+        then None, or the exception if decoding failed. ffmpeg decodes only the
+        sampled frames; if it isn't usable, OpenCV grabs unsampled frames
+        without retrieving them. Near-duplicates
+        of the last detected frame are pushed as (frame_num, None).
+        """
+        def put(item):
+            # Give up if the consumer has stopped, rather than block forever
+            while not stop_event.is_set():
+                try:
+                    frame_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        last_thumb = None
+        reused = 0
+        
+        def put_sample(item):
+            nonlocal last_thumb, reused
+            frame_num, frame = item
+            thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+            if (last_thumb is not None and reused < MAX_REUSED_FRAMES
+                    and cv2.absdiff(thumb, last_thumb).mean() < SCENE_CHANGE_THRESHOLD):
+                reused += 1
+                return put((frame_num, None))
+            
+            last_thumb = thumb
+            reused = 0
+            return put(item)
+        
+        end = None
+        try:
+            # NVDEC first on CUDA machines, then software/auto ffmpeg, then OpenCV
+            if torch.cuda.is_available() and self._read_frames_ffmpeg(
+                video_path, sample_rate, put_sample, stop_event, nvdec=True
+            ):
+                return
+            if self._read_frames_ffmpeg(video_path, sample_rate, put_sample, stop_event):
+                return
+            
+            # Always grab() forward (no CAP_PROP_POS_FRAMES seeks, which
+            # re-decode from the keyframe) and only retrieve() sampled frames,
+            # so skipped frames never pay for color conversion and copy
+            frame_num = 0
+            while cap.isOpened() and not stop_event.is_set():
+                if not cap.grab():
+                    break
+                if frame_num % sample_rate == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret or not put_sample((frame_num, frame)):
+                        break
+                
+                frame_num += 1
+        except Exception as e:
+            # Hand the failure to process_video instead of ending the video early
+            end = e
+        finally:
+            put(end)
+    
+    def _read_frames_ffmpeg(self, video_path, sample_rate, put, stop_event, nvdec=False) -> bool:
+        """
+        Stream every sample_rate-th frame as raw BGR from ffmpeg's select filter.
+        With nvdec, frames are decoded and selected on the GPU and only the
+        sampled ones are downloaded. Returns False (nothing pushed) when
+        ffmpeg/ffprobe (or NVDEC for this stream) can't be used, and raises
+        if ffmpeg fails after frames were already pushed.
+        """
+        try:
+            frame_size = self._probe_frame_size(video_path)
+        except (OSError, ValueError) as e:
+            logger.warning("ffprobe failed, decoding with OpenCV: %s", e)
+            return False
+        if frame_size is None:
+            return False
+        
+        width, height = frame_size
+        select = f"select='not(mod(n,{sample_rate}))'"
+        if nvdec:
+            # Frames stay in GPU memory through decode and select
+            hwaccel = ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda']
+            video_filter = f"{select},hwdownload,format=nv12"
+        else:
+            # Hardware decode when ffmpeg finds one (it falls back to software
+            # on its own), with frame-threaded software decoding otherwise
+            hwaccel = ['-hwaccel', 'auto']
+            video_filter = select
+        
+        cmd = [
+            'ffmpeg',
+            '-v', 'error',
+            *hwaccel,
+            '-threads', '0',
+            '-i', video_path,
+            '-vf', video_filter,
+            '-vsync', '0',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            'pipe:1'
+        ]
+        # stderr goes to a file: an undrained pipe could fill up and stall ffmpeg
+        stderr = tempfile.TemporaryFile()
+        try:
+            # Unbuffered: frames are read straight into their own buffers
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, bufsize=0)
+        except OSError as e:
+            stderr.close()
+            logger.warning("ffmpeg not available, decoding with OpenCV: %s", e)
+            return False
+        
+        frames_read = 0
+        eof = False
+        try:
+            while not stop_event.is_set():
+                buffer = _read_exact(proc.stdout, width * height * 3)
+                if buffer is None:
+                    eof = True
+                    break
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+                if not put((frames_read * sample_rate, frame)):
+                    break
+                frames_read += 1
+        finally:
+            # At EOF ffmpeg is exiting on its own; let it report its status
+            if not eof and proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+            stderr.seek(0)
+            error = stderr.read().decode(errors='replace').strip()
+            stderr.close()
+        
+        # A non-zero exit at EOF is a decode failure, not the end of the video
+        if eof and returncode != 0:
+            message = f"ffmpeg{' (NVDEC)' if nvdec else ''} exited with {returncode}: {error[-500:]}"
+            if frames_read == 0:
+                logger.warning("%s; trying the next decoder", message)
+                return False
+            raise RuntimeError(message)
+        
+        return frames_read > 0
+    
+    def _probe_frame_size(self, video_path) -> Optional[Tuple[int, int]]:
+        """Displayed (width, height) of the first video stream, after rotation."""
+        cmd = [
+            'ffprobe',
+            '-v', 'quiet',
+            '-select_streams', 'v:0',
+            '-print_format', 'json',
+            '-show_streams',
+            video_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        streams = json.loads(result.stdout or '{}').get('streams', [])
+        if not streams:
+            return None
+        
+        stream = streams[0]
+        width, height = int(stream.get('width', 0)), int(stream.get('height', 0))
+        if not width or not height:
+            return None
+        
+        # ffmpeg autorotates, so portrait phone videos come out with swapped sides
+        rotation = stream.get('tags', {}).get('rotate', 0)
+        for side_data in stream.get('side_data_list', []):
+            rotation = side_data.get('rotation', rotation)
+        if abs(int(float(rotation))) % 180 == 90:
+            width, height = height, width
+        
+        return width, height
+    
     async def process_video(self, video_id: str, video_path: str, progress_callback=None, log_callback=None) -> Dict:
         """
         Process entire video: detect objects with OWL-ViT, segment with SAM, track them, and find products.
@@ -142,92 +409,202 @@ class VideoProcessor:
             await log_callback(f"Starting video processing for {video_id}")
             await log_callback("Using OWL-ViT (zero-shot detection) + SAM (segmentation) + IoU tracking")
         
-        # Open video
-        cap = cv2.VideoCapture(video_path)
+        # Open video; opening probes the container, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        cap = await loop.run_in_executor(None, cv2.VideoCapture, video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
         # Storage for tracking data
-        tracks_by_frame = {}  # timestamp_ms -> [detections]
+        track_log = _TrackLog()  # per-frame detections
         object_products = {}  # track_id -> product info
+        first_seen = {}  # track_id -> timestamp_ms of its first frame
         
         # Process every Nth frame (sample rate for performance)
         sample_rate = max(1, int(fps / 2))  # Process 2 frames per second
         
-        frame_num = 0
-        processed_frames = 0
-        next_track_id = 1
-        previous_detections = []
+        # Decode on a reader thread so the next sampled frame is ready
+        # while the current one is on the GPU
+        frame_queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        stop_reading = threading.Event()
+        reader = threading.Thread(
+            target=self._read_frames,
+            args=(cap, video_path, sample_rate, frame_queue, stop_reading),
+            daemon=True
+        )
+        reader.start()
         
-        # Process frames
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Only process sampled frames
-            if frame_num % sample_rate == 0:
-                # Detect objects using OWL-ViT
-                detections = self.grounding_dino.detect_products(frame)
-                
-                # Assign track IDs based on IoU matching
-                detections, next_track_id = self._assign_track_ids(
-                    detections, previous_detections, next_track_id
-                )
+        # Stages: decode (reader thread) -> detect -> track -> SAM -> product
+        # search, so detection of one batch overlaps tracking, SAM and product
+        # search for the previous one. Each GPU stage has one worker thread (and its own
+        # CUDA stream), so a model is only ever driven from one thread.
+        track_queue = asyncio.Queue(maxsize=2)  # detected batches
+        segment_queue = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
+        product_queue = asyncio.Queue()
+        stats = {'processed_frames': 0}
+        
+        async def detect_stage():
+            # Sampled frames are detected in micro-batches of
+            # DETECTION_BATCH_SIZE; tracking happens in track_stage, so the
+            # next batch is already on the GPU while this one is tracked.
+            # Near-duplicate frames (frame is None) ride along undetected.
+            batch = []
+            pending = 0
+            done = False
+            while not done:
+                item = await loop.run_in_executor(None, _get_frame, frame_queue, stop_reading)
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+                    pending += item[1] is not None
+                if not batch or (not done and pending < settings.DETECTION_BATCH_SIZE):
+                    continue
                 
-                frame_detections = []
+                # Detect objects using OWL-ViT
+                frames = [frame for _, frame in batch if frame is not None]
+                detected = []
+                if frames:
+                    detected = await loop.run_in_executor(
+                        self._detect_executor, self._run_on_stream, 'detect',
+                        self.grounding_dino.detect_products_batch, frames
+                    )
+                detected = iter(detected)
+                batch_detections = [None if frame is None else next(detected) for _, frame in batch]
+                await track_queue.put((batch, batch_detections))
+                batch = []
+                pending = 0
+            
+            await track_queue.put(None)
+        
+        async def track_stage():
+            # Tracking is stateful, so it stays in this one stage, in frame order
+            next_track_id = 1
+            previous_detections = []
+            last_progress = -1
+            
+            while True:
+                item = await track_queue.get()
+                if item is None:
+                    break
+                batch, batch_detections = item
                 
-                for detection in detections:
-                    track_id = detection['track_id']
+                for (frame_num, frame), detections in zip(batch, batch_detections):
+                    timestamp_ms = int((frame_num / fps) * 1000)
                     
-                    frame_detection = {
-                        'track_id': track_id,
-                        'bbox': detection['bbox'],
-                        'class': detection['label'],
-                        'confidence': detection['confidence']
-                    }
+                    if detections is None:
+                        # Scene unchanged since the last detected frame: reuse its tracks
+                        track_log.append(timestamp_ms, previous_detections)
+                        stats['processed_frames'] += 1
+                        continue
                     
-                    frame_detections.append(frame_detection)
+                    # Assign track IDs based on IoU matching
+                    detections, next_track_id = self._assign_track_ids(
+                        detections, previous_detections, next_track_id
+                    )
                     
-                    # Process new tracks (segment with SAM and find products)
-                    if track_id not in object_products:
-                        timestamp_ms = int((frame_num / fps) * 1000)
-                        product_info = await self._process_tracked_object(
-                            frame, detection, track_id, video_id, timestamp_ms
-                        )
-                        object_products[track_id] = product_info
-                        log_msg = f"Track {track_id}: {detection['label']} [OWL-ViT + SAM] -> {product_info['category']}"
-                        print(log_msg)
-                        if log_callback:
-                            await log_callback(log_msg)
-                
-                # Store frame detections
-                timestamp_ms = int((frame_num / fps) * 1000)
-                tracks_by_frame[timestamp_ms] = frame_detections
-                
-                # Update previous detections for next frame
-                previous_detections = detections
-                
-                processed_frames += 1
-                
-                # Progress callback with detailed message
-                if progress_callback:
+                    # New tracks go on to SAM and product search
+                    new_tracks = [d for d in detections if d['track_id'] not in first_seen]
+                    if new_tracks:
+                        first_seen.update((d['track_id'], timestamp_ms) for d in new_tracks)
+                        await segment_queue.put((frame, new_tracks, timestamp_ms))
+                    
+                    # Store frame detections
+                    track_log.append(timestamp_ms, detections)
+                    
+                    # Update previous detections for next frame
+                    previous_detections = detections
+                    
+                    stats['processed_frames'] += 1
+                    
+                    # Progress callback with detailed message, once per whole percent
                     progress = (frame_num / total_frames) * 100
-                    message = f"Processing frame {frame_num}/{total_frames} - Found {len(detections)} objects"
-                    await progress_callback(progress, message)
+                    if progress_callback and int(progress) != last_progress:
+                        last_progress = int(progress)
+                        message = f"Processing frame {frame_num}/{total_frames} - Found {len(detections)} objects"
+                        await progress_callback(progress, message)
+            
+            await segment_queue.put(None)
+        
+        async def segment_stage():
+            while True:
+                item = await segment_queue.get()
+                if item is None:
+                    break
+                frame, new_tracks, timestamp_ms = item
+                
+                mask_urls = await loop.run_in_executor(
+                    self._segment_executor, self._run_on_stream, 'segment',
+                    self._segment_tracks, frame, new_tracks, video_id, timestamp_ms
+                )
+                for detection, mask_url in zip(new_tracks, mask_urls):
+                    await product_queue.put((detection, mask_url))
             
-            frame_num += 1
+            await product_queue.put(None)
         
-        cap.release()
+        async def find_product(detection, mask_url):
+            product_info = await self._find_product(detection, mask_url)
+            log_msg = f"Track {detection['track_id']}: {detection['label']} [OWL-ViT + SAM] -> {product_info['category']}"
+            print(log_msg)
+            if log_callback:
+                await log_callback(log_msg)
+            return product_info
         
+        async def product_stage():
+            # Lookups are HTTP round-trips, so they run concurrently instead
+            # of one after another; results are stored in track order
+            lookups = []
+            try:
+                while True:
+                    item = await product_queue.get()
+                    if item is None:
+                        break
+                    lookups.append(asyncio.create_task(find_product(*item)))
+                
+                for product_info in await asyncio.gather(*lookups):
+                    object_products[product_info['track_id']] = product_info
+            finally:
+                for lookup in lookups:
+                    lookup.cancel()
+        
+        stages = [asyncio.create_task(stage()) for stage in (
+            detect_stage, track_stage, segment_stage, product_stage
+        )]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            # One stage failed; the others would wait on their queues forever
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+        finally:
+            stop_reading.set()
+            reader.join()
+            cap.release()
+            self.segmentation_service.release_tracks(video_id)
+        
+        processed_frames = stats['processed_frames']
         print(f"Processed {processed_frames} frames, found {len(object_products)} unique objects")
         
+        # Stills of each object's first frame, all from one ffmpeg select pass
+        if object_products:
+            frame_paths = await self.frame_extractor.extract_frames(
+                video_path, video_id, sorted(set(first_seen.values()))
+            )
+            for track_id, product_info in object_products.items():
+                frame_path = frame_paths.get(first_seen[track_id])
+                if frame_path:
+                    product_info['frame_url'] = f"/static/frames/{os.path.basename(frame_path)}"
+        
         # Save tracking data to JSON
         output_data = {
             'video_id': video_id,
             'fps': fps,
             'total_frames': total_frames,
-            'tracks_by_frame': tracks_by_frame,
+            'tracks_by_frame': track_log.tracks_by_frame(),
             'object_products': object_products
         }
         
@@ -235,70 +612,80 @@ class VideoProcessor:
         output_path = os.path.join(settings.STORAGE_PATH, 'tracking', f'{video_id}_tracking.json')
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
-        with open(output_path, 'w') as f:
-            json.dump(output_data, f)
+        # orjson: timestamp keys are ints (stringified like json.dump did)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
         
         return output_data
     
-    async def _process_tracked_object(self, frame, detection, track_id, video_id, timestamp_ms):
-        """Process a tracked object: segment with SAM and find products."""
+    def _run_on_stream(self, stage: str, fn, *args):
+        """Call fn on this stage's CUDA stream (worker threads only); plain call elsewhere."""
+        if not torch.cuda.is_available():
+            return fn(*args)
+        
+        stream = self._streams.get(stage)
+        if stream is None:
+            stream = self._streams[stage] = torch.cuda.Stream()
+        with torch.cuda.stream(stream):
+            result = fn(*args)
+        # Results are host-side (lists / numpy), but make the stream's work visible
+        stream.synchronize()
+        return result
+    
+    def _segment_tracks(self, frame, detections, video_id, timestamp_ms) -> List[Optional[str]]:
+        """
+        SAM masks for a frame's new tracks. Returns each track's mask URL, or
+        None where segmentation failed (the track falls back to OWL-ViT only).
+        """
+        mask_dir = os.path.join(settings.STORAGE_PATH, 'masks', video_id)
+        os.makedirs(mask_dir, exist_ok=True)
+        mask_filenames = [
+            f"track_{detection['track_id']}_frame_{timestamp_ms}.png"
+            for detection in detections
+        ]
+        
         try:
-            category = detection['label']
-            bbox = detection['bbox']
-            
-            # Use SAM to get precise segmentation mask
-            # Use bounding box as prompt for better accuracy
-            h, w = frame.shape[:2]
-            
-            # Save frame temporarily for SAM
-            temp_frame_dir = os.path.join(settings.STORAGE_PATH, 'temp_frames')
-            os.makedirs(temp_frame_dir, exist_ok=True)
-            temp_frame_path = os.path.join(temp_frame_dir, f'{video_id}_{track_id}_{timestamp_ms}.jpg')
-            cv2.imwrite(temp_frame_path, frame)
-            
-            # Get segmentation mask from SAM using box prompt
-            mask_result = await self.segmentation_service.segment_with_box(
-                temp_frame_path,
-                bbox,
-                video_id,
-                timestamp_ms
+            # SAM takes RGB; convert once per frame. The image encoder runs
+            # once and all new tracks' box prompts go through one batched
+            # mask decoder call, with masks written straight to masks/
+            frame_rgb = np.ascontiguousarray(frame[..., ::-1])
+            self.segmentation_service.segment_boxes_array(
+                frame_rgb,
+                [detection['bbox'] for detection in detections],
+                [os.path.join(mask_dir, mask_filename) for mask_filename in mask_filenames]
             )
-            
-            # Clean up temp frame
-            os.remove(temp_frame_path)
-            
-            # Save mask image to masks directory
-            mask_dir = os.path.join(settings.STORAGE_PATH, 'masks', video_id)
-            os.makedirs(mask_dir, exist_ok=True)
-            mask_filename = f'track_{track_id}_frame_{timestamp_ms}.png'
-            mask_path = os.path.join(mask_dir, mask_filename)
-            
-            # Copy mask from crops to masks directory
-            source_mask = mask_result['mask_url'].replace('/static/crops/', '')
-            source_mask_path = os.path.join(settings.STORAGE_PATH, 'crops', source_mask)
-            if os.path.exists(source_mask_path):
-                import shutil
-                shutil.copy(source_mask_path, mask_path)
-            
-            # Search for products
-            products = await self.product_search.search_products(category, top_k=1)
-            product = products[0] if products else None
-            
-            return {
-                'track_id': track_id,
-                'category': category,
-                'detection_method': 'owlvit_sam',
-                'mask_url': f'/static/masks/{video_id}/{mask_filename}',
-                'product': product.model_dump(mode='json') if product else None
-            }
         except Exception as e:
-            print(f"Error processing track {track_id}: {e}")
-            # Fallback without SAM
-            products = await self.product_search.search_products(detection['label'], top_k=1)
-            product = products[0] if products else None
-            return {
-                'track_id': track_id,
-                'category': detection['label'],
-                'detection_method': 'owlvit',
-                'product': product.model_dump(mode='json') if product else None
-            }
+            track_ids = [detection['track_id'] for detection in detections]
+            logger.error("Error segmenting tracks %s: %s", track_ids, e)
+            return [None] * len(detections)
+        
+        return [f'/static/masks/{video_id}/{mask_filename}' for mask_filename in mask_filenames]
+    
+    async def _find_product(self, detection, mask_url: Optional[str]) -> Dict:
+        """Search for a product for a tracked object (with or without a SAM mask)."""
+        category = detection['label']
+        
+        # Search for products
+        products = await self.product_search.search_products(category, top_k=1)
+        product = products[0] if products else None
+        
+        product_info = {
+            'track_id': detection['track_id'],
+            'category': category,
+            # Fallback without SAM when segmentation failed
+            'detection_method': 'owlvit_sam' if mask_url else 'owlvit'
+        }
+        if mask_url:
+            product_info['mask_url'] = mask_url
+        product_info['product'] = product.model_dump(mode='json') if product else None
+        
+        return product_info
+
+# Models are loaded once per process and shared by every job
+_video_processor: Optional[VideoProcessor] = None
+
+def get_video_processor() -> VideoProcessor:
+    global _video_processor
+    if _video_processor is None:
+        _video_processor = VideoProcessor()
+    return _video_processor
@@ -0,0 +1,27 @@
+"""Celery application for offloading video processing from the API."""
+
+from celery import Celery
+
+from app.core.config import settings
+
+celery_app = Celery(
+    "visor",
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
+    include=["app.workers.tasks"]
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    # Long-running ML jobs: take one at a time and only ack once finished
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    # Children load and warm up OWL-ViT, SAM 2 and CLIP in worker_process_init
+    # before reporting UP; the 4 s default would kill them mid-preload
+    worker_proc_alive_timeout=600,
+    task_routes={
+        "app.workers.tasks.process_video_task": {"queue": "gpu"},
+    }
+)
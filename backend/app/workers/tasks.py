@@ -0,0 +1,85 @@
+"""Celery tasks for video processing."""
+
+import asyncio
+import time
+
+from celery.signals import worker_process_init
+
+from app.core.cache import cache
+from app.core.job_store import job_store, tracking_cache_key
+from app.core.storage import storage
+from app.services.product_search import close_session
+from app.services.video_processor import get_video_processor
+from app.workers.celery_app import celery_app
+
+# Progress writes are skipped unless it moved 1% or 250 ms have passed
+PROGRESS_MIN_DELTA = 1.0
+PROGRESS_MIN_INTERVAL = 0.25
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    """Load and warm up the models in each worker process before it takes a task."""
+    get_video_processor().preload()
+
+async def run_video_job(video_id: str, video_path: str, lock_token: str):
+    """Run the processing pipeline, reporting progress to the job store."""
+    video_processor = get_video_processor()
+    try:
+        last_update = [0.0, 0.0]  # progress, monotonic time
+        
+        async def update_progress(progress: float, message: str = None):
+            now = time.monotonic()
+            if (progress - last_update[0] < PROGRESS_MIN_DELTA
+                    and now - last_update[1] < PROGRESS_MIN_INTERVAL):
+                return
+            last_update[0], last_update[1] = progress, now
+            
+            await job_store.update(
+                video_id,
+                progress=progress,
+                message=message or f"Processing... {progress:.1f}%"
+            )
+        
+        async def log_message(message: str):
+            await job_store.append_log(video_id, message)
+        
+        # Process video (presign S3 objects only now, so queue time can't expire the URL)
+        video_path = storage.resolve_path(video_path)
+        await video_processor.process_video(video_id, video_path, update_progress, log_message)
+        
+        # Drop any stale cached tracking data from a previous run
+        await cache.delete(tracking_cache_key(video_id))
+        
+        # Update status
+        await job_store.update(
+            video_id,
+            status="completed",
+            progress=100.0,
+            message="Video processing completed successfully"
+        )
+        
+    except Exception as e:
+        print(f"Error processing video {video_id}: {e}")
+        await job_store.update(
+            video_id,
+            status="failed",
+            progress=0.0,
+            message=f"Processing failed: {str(e)}"
+        )
+    finally:
+        await job_store.release_lock(video_id, lock_token)
+
+async def _run_task_job(video_id: str, video_path: str, lock_token: str):
+    """run_video_job on a Celery task's own event loop."""
+    try:
+        await run_video_job(video_id, video_path, lock_token)
+    finally:
+        # The Redis client and HTTP session are bound to this task's event loop.
+        # In-process jobs share the app's loop (and session), so only here.
+        await cache.disconnect()
+        await close_session()
+
+@celery_app.task(name="app.workers.tasks.process_video_task", queue="gpu")
+def process_video_task(video_id: str, video_path: str, lock_token: str):
+    """Process a video on a GPU worker."""
+    asyncio.run(_run_task_job(video_id, video_path, lock_token))
@@ -22,6 +22,7 @@ export default function VideoPlayer({ onProductsFound }: VideoPlayerProps) {
   const canvasRef = useRef<HTMLCanvasElement>(null)
   const containerRef = useRef<HTMLDivElement>(null)
   const pollIntervalRef = useRef<NodeJS.Timeout | null>(null)
+  const statusSocketRef = useRef<WebSocket | null>(null)
   
   const [videoId, setVideoId] = useState<string | null>(null)
   const [videoUrl, setVideoUrl] = useState<string | null>(null)
@@ -35,12 +36,13 @@ export default function VideoPlayer({ onProductsFound }: VideoPlayerProps) {
   const [videoAspectRatio, setVideoAspectRatio] = useState<'horizontal' | 'vertical'>('horizontal')
   const [renderKey, setRenderKey] = useState(0)
 
-  // Cleanup interval on unmount
+  // Cleanup interval and status socket on unmount
   useEffect(() => {
     return () => {
       if (pollIntervalRef.current) {
         clearInterval(pollIntervalRef.current)
       }
+      statusSocketRef.current?.close()
     }
   }, [])
 
@@ -52,7 +54,11 @@ export default function VideoPlayer({ onProductsFound }: VideoPlayerProps) {
     try {
       const video = await api.uploadVideo(file)
       setVideoId(video.video_id)
-      setVideoUrl(`${process.env.NEXT_PUBLIC_API_URL}${video.url}`)
+      setVideoUrl(
+        video.url.startsWith('http')
+          ? video.url
+          : `${process.env.NEXT_PUBLIC_API_URL}${video.url}`
+      )
       
       await api.logEvent({
         event_type: 'video_upload',
@@ -79,50 +85,69 @@ export default function VideoPlayer({ onProductsFound }: VideoPlayerProps) {
       // Trigger processing
       await api.startProcessing(videoId)
 
-      // Clear any existing interval
+      // Clear any existing interval or socket
       if (pollIntervalRef.current) {
         clearInterval(pollIntervalRef.current)
       }
-
-      // Poll for status
-      pollIntervalRef.current = setInterval(async () => {
-        try {
-          const status = await api.getProcessingStatus(videoId)
-          console.log('Processing status:', status)
-          console.log('Progress:', status.progress, 'Message:', status.message)
-          console.log('Logs count:', status.logs?.length || 0)
-          
-          // Update all state at once
-          setProcessingProgress(status.progress)
-          setProcessingMessage(status.message)
-          setProcessingLogs(status.logs || [])
-          setRenderKey(prev => prev + 1) // Force re-render
-          
-          if (status.logs && status.logs.length > 0) {
-            console.log('Latest logs:', status.logs.slice(-3))
+      statusSocketRef.current?.close()
+
+      // Prefer pushed updates; fall back to polling if the socket fails
+      let finished = false
+      let logs: string[] = []
+      const handleStatus = async (status: any) => {
+        setProcessingProgress(status.progress)
+        setProcessingMessage(status.message)
+        setProcessingLogs(status.logs || [])
+        setRenderKey(prev => prev + 1) // Force re-render
+
+        if (status.status === 'completed' || status.status === 'failed') {
+          finished = true
+          if (pollIntervalRef.current) {
+            clearInterval(pollIntervalRef.current)
+            pollIntervalRef.current = null
           }
-
+          statusSocketRef.current?.close()
+          statusSocketRef.current = null
+          setIsProcessing(false)
           if (status.status === 'completed') {
-            console.log('Processing completed! Loading tracking data...')
-            if (pollIntervalRef.current) {
-              clearInterval(pollIntervalRef.current)
-              pollIntervalRef.current = null
-            }
-            setIsProcessing(false)
             // Load tracking data
             await loadTrackingData(videoId)
-          } else if (status.status === 'failed') {
-            if (pollIntervalRef.current) {
-              clearInterval(pollIntervalRef.current)
-              pollIntervalRef.current = null
-            }
-            setIsProcessing(false)
+          } else {
             alert('Video processing failed')
           }
-        } catch (error) {
-          console.error('Status check failed:', error)
         }
-      }, 2000) // Poll every 2 seconds
+      }
+
+      const startPolling = () => {
+        pollIntervalRef.current = setInterval(async () => {
+          try {
+            await handleStatus(await api.getProcessingStatus(videoId))
+          } catch (error) {
+            console.error('Status check failed:', error)
+          }
+        }, 2000) // Poll every 2 seconds
+      }
+
+      let current: any = {}
+      const socket = api.subscribeProcessingStatus(videoId)
+      statusSocketRef.current = socket
+      socket.onmessage = (event) => {
+        const update = JSON.parse(event.data)
+        if (update.log !== undefined) {
+          logs = [...logs, update.log].slice(-50)
+          current = { ...current, logs }
+        } else {
+          if (update.logs) logs = update.logs
+          current = { ...current, ...update, logs }
+        }
+        handleStatus(current)
+      }
+      socket.onclose = () => {
+        if (!finished && statusSocketRef.current === socket) {
+          statusSocketRef.current = null
+          startPolling()
+        }
+      }
     } catch (error) {
       console.error('Failed to start processing:', error)
       setIsProcessing(false)
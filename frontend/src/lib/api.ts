@@ -2,6 +2,8 @@ import axios from 'axios'
 import { Video, SegmentedObject, RetrieveResponse, AnalyticsEvent } from '@/types'
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
+// Upload straight to S3/MinIO via presigned URLs (backend STORAGE_TYPE=s3)
+const DIRECT_UPLOAD = process.env.NEXT_PUBLIC_DIRECT_UPLOAD === 'true'
 
 const apiClient = axios.create({
   baseURL: API_URL,
@@ -12,6 +14,21 @@ const apiClient = axios.create({
 
 export const api = {
   uploadVideo: async (file: File): Promise<Video> => {
+    if (DIRECT_UPLOAD) {
+      const presign = await apiClient.post('/api/videos/presign', {
+        filename: file.name,
+        content_type: file.type || null,
+      })
+      await axios.put(presign.data.upload_url, file, {
+        headers: file.type ? { 'Content-Type': file.type } : {},
+      })
+      const response = await apiClient.post('/api/videos/finalize', {
+        video_id: presign.data.video_id,
+        object_key: presign.data.object_key,
+      })
+      return response.data
+    }
+
     const formData = new FormData()
     formData.append('file', file)
     const response = await apiClient.post('/api/videos', formData, {
@@ -49,6 +66,13 @@ export const api = {
     return response.data
   },
 
+  // Opens a WebSocket that pushes status updates: a full snapshot first,
+  // then changed fields or { log } entries
+  subscribeProcessingStatus: (videoId: string): WebSocket => {
+    const wsUrl = API_URL.replace(/^http/, 'ws')
+    return new WebSocket(`${wsUrl}/api/ws/process/${videoId}`)
+  },
+
   getTrackingData: async (videoId: string): Promise<any> => {
     const response = await apiClient.get(`/api/tracking/${videoId}`)
     return response.data
@@ -8,7 +8,10 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
-from app.services.video_processor import VideoProcessor
+from app.services.video_processor import get_video_processor
+
+# Print every detected object and sample detections: test_processing.py --verbose
+VERBOSE = "--verbose" in sys.argv
 
 async def test_processing():
     """Test video processing with a sample video."""
@@ -28,11 +31,13 @@ async def test_processing():
     print("Starting video processing test...")
     print("="*60 + "\n")
     
-    processor = VideoProcessor()
+    # Load and warm up the models outside the measured run
+    processor = get_video_processor()
+    processor.preload()
     
     # Progress callback
-    async def show_progress(progress):
-        print(f"Progress: {progress:.1f}%")
+    async def show_progress(progress, message=""):
+        print(f"Progress: {progress:.1f}% {message}")
     
     try:
         # Process video
@@ -52,37 +57,37 @@ async def test_processing():
         print(f"Processed Frames: {len(result['tracks_by_frame'])}")
         print(f"Unique Objects: {len(result['object_products'])}")
         
-        print("\n" + "-"*60)
-        print("Detected Objects:")
-        print("-"*60)
-        
-        for track_id, obj_data in result['object_products'].items():
-            print(f"\nTrack ID {track_id}:")
-            print(f"  Category: {obj_data['category']}")
-            print(f"  Detection: {obj_data.get('detection_method', 'unknown')}")
-            if obj_data['product']:
-                print(f"  Product: {obj_data['product']['title']}")
-                print(f"  Price: ${obj_data['product']['price']}")
-                print(f"  Buy URL: {obj_data['product']['buy_url']}")
-            else:
-                print(f"  Product: None found")
-        
-        print("\n" + "-"*60)
-        print("Sample Frame Data (first frame):")
-        print("-"*60)
-        
-        first_timestamp = list(result['tracks_by_frame'].keys())[0]
-        first_frame = result['tracks_by_frame'][first_timestamp]
-        
-        print(f"\nTimestamp: {first_timestamp}ms")
-        print(f"Detections: {len(first_frame)}")
-        
-        for detection in first_frame[:3]:  # Show first 3 detections
-            print(f"\n  Track ID: {detection['track_id']}")
-            print(f"  Class: {detection['class']}")
-            print(f"  Confidence: {detection['confidence']:.2f}")
-            print(f"  BBox: x={detection['bbox']['x']:.0f}, y={detection['bbox']['y']:.0f}, "
-                  f"w={detection['bbox']['width']:.0f}, h={detection['bbox']['height']:.0f}")
+        # Per-object and per-detection details only with --verbose, written in one go
+        if VERBOSE:
+            lines = ["", "-"*60, "Detected Objects:", "-"*60]
+            
+            for track_id, obj_data in result['object_products'].items():
+                lines.append(f"\nTrack ID {track_id}:")
+                lines.append(f"  Category: {obj_data['category']}")
+                lines.append(f"  Detection: {obj_data.get('detection_method', 'unknown')}")
+                if obj_data['product']:
+                    lines.append(f"  Product: {obj_data['product']['title']}")
+                    lines.append(f"  Price: ${obj_data['product']['price']}")
+                    lines.append(f"  Buy URL: {obj_data['product']['buy_url']}")
+                else:
+                    lines.append(f"  Product: None found")
+            
+            lines += ["", "-"*60, "Sample Frame Data (first frame):", "-"*60]
+            
+            first_timestamp = list(result['tracks_by_frame'].keys())[0]
+            first_frame = result['tracks_by_frame'][first_timestamp]
+            
+            lines.append(f"\nTimestamp: {first_timestamp}ms")
+            lines.append(f"Detections: {len(first_frame)}")
+            
+            for detection in first_frame[:3]:  # Show first 3 detections
+                lines.append(f"\n  Track ID: {detection['track_id']}")
+                lines.append(f"  Class: {detection['class']}")
+                lines.append(f"  Confidence: {detection['confidence']:.2f}")
+                lines.append(f"  BBox: x={detection['bbox']['x']:.0f}, y={detection['bbox']['y']:.0f}, "
+                             f"w={detection['bbox']['width']:.0f}, h={detection['bbox']['height']:.0f}")
+            
+            sys.stdout.write("\n".join(lines) + "\n")
         
         print("\n" + "="*60)
         print("✅ Test completed successfully!")
@@ -1,13 +1,34 @@
-import torch
-import cv2
-import fastapi
-import ultralytics
-import transformers
+import subprocess
+import sys
+from importlib.metadata import PackageNotFoundError, version
+
+# Versions come from package metadata, so torch/cv2 (and their CUDA
+# libraries) are never imported just to print a version string
+PACKAGES = [
+    ("Torch", "torch"),
+    ("OpenCV", "opencv-python"),
+    ("FastAPI", "fastapi"),
+    ("YOLO", "ultralytics"),
+    ("Transformers", "transformers"),
+]
 
 print("Python OK")
-print("Torch:", torch.__version__)
-print("CUDA available:", torch.cuda.is_available())
-print("OpenCV:", cv2.__version__)
-print("FastAPI:", fastapi.__version__)
-print("YOLO:", ultralytics.__version__)
-print("Transformers:", transformers.__version__)
+for name, package in PACKAGES:
+    try:
+        print(f"{name}:", version(package))
+    except PackageNotFoundError:
+        print(f"{name}: not installed")
+
+# GPU check only on request: python verify_env.py --cuda
+if "--cuda" in sys.argv:
+    try:
+        result = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True)
+        print(result.stdout.strip())
+    except FileNotFoundError:
+        print("nvidia-smi not found")
+    
+    # A visible driver doesn't mean the installed torch build can use it
+    import torch
+    
+    print("CUDA available:", torch.cuda.is_available())
+    assert torch.cuda.is_available(), "torch cannot use CUDA"